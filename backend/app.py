@@ -4,57 +4,306 @@ import base64
 import json
 import traceback
 import sys
+import gzip
+import functools
+import uuid
 from flask import Flask, request, jsonify
 from flask_cors import CORS
 import google.generativeai as genai
 from gtts import gTTS
 import pygame
-from pymongo import MongoClient
-from datetime import datetime
+from pymongo import MongoClient, UpdateOne
+from pymongo.errors import BulkWriteError, OperationFailure
+from datetime import datetime, timezone
+from speech_stream import SpeechPipeline
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
 
 app = Flask(__name__)
 CORS(app)
 pygame.mixer.init()
 
+valid_statuses = {"new", "reviewing", "resolved", "false-alarm"}
+
+ALERTS_VERSION_ID = "alerts"
+
+
+def connect_database(client):
+    """Point the app at the database of a MongoClient (or a compatible client, e.g. in tests)."""
+    global mongo_client, db, alerts_collection, alert_stats_collection, meta_collection, alert_indexes_ready
+    mongo_client = client
+    db = mongo_client["Cluster0"]
+    alerts_collection = db["alerts"]
+    # One rollup document per (location, hour) with alert counts by status,
+    # kept up to date by every write to alerts_collection
+    alert_stats_collection = db["alert_stats"]
+    # Version counter of the alerts, bumped on every write. Alert reads derive
+    # their ETag and Last-Modified from it, so clients polling an unchanged
+    # collection get a 304 without the alerts being loaded at all.
+    meta_collection = db["meta"]
+    alert_indexes_ready = False
+
+
+def ensure_alert_indexes():
+    """Create the unique index on alert ids, once per connection, before the first write.
+
+    An existing collection that already holds duplicate ids cannot get the
+    index; writes still skip ids that are stored, just without the index
+    guarding against two concurrent inserts of the same id.
+    """
+    global alert_indexes_ready
+    if alert_indexes_ready:
+        return
+    try:
+        alerts_collection.create_index("id", unique=True)
+    except OperationFailure as e:
+        print(f"Could not create the unique index on alert ids: {e}")
+    alert_indexes_ready = True
+
+
 mongo_uri = os.getenv("MONGODB_URI")
-mongo_client = MongoClient(mongo_uri)
-db = mongo_client["Cluster0"]
-alerts_collection = db["alerts"]
+connect_database(MongoClient(mongo_uri))
+
+# Responses at least this large are compressed if the client accepts it
+COMPRESS_MIN_SIZE = 1024
+
+
+def bump_alerts_version():
+    """Record a change to the alerts collection."""
+    meta_collection.update_one(
+        {"_id": ALERTS_VERSION_ID},
+        {"$inc": {"version": 1}, "$currentDate": {"updated": True}},
+        upsert=True,
+    )
+
+
+def alerts_version():
+    """Return (version, last modified) of the alerts collection."""
+    meta = meta_collection.find_one({"_id": ALERTS_VERSION_ID}) or {}
+    updated = meta.get("updated")
+    if updated is not None:
+        updated = updated.replace(tzinfo=timezone.utc, microsecond=0)
+    return meta.get("version", 0), updated
+
+
+def conditional_on_alerts(view):
+    """Serve a GET view with an ETag and Last-Modified from the alerts version.
+
+    Returns 304 Not Modified when the client's ETag is current. If-Modified-Since
+    alone is not honoured: Last-Modified has one second resolution, so a write
+    later in the same second as the client's copy would go unnoticed.
+    """
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        version, updated = alerts_version()
+        etag = f"alerts-{version}"
+
+        if request.if_none_match:
+            # Compressed copies carry the encoding in the ETag, e.g. "alerts-7-gzip"
+            tags = {tag.rsplit("-", 1)[0] if tag.endswith(("-gzip", "-br")) else tag
+                    for tag in request.if_none_match.as_set()}
+            if etag in tags or request.if_none_match.star_tag:
+                return not_modified(etag, updated)
+
+        response = app.make_response(view(*args, **kwargs))
+        if response.status_code == 200:
+            response.set_etag(etag)
+            if updated is not None:
+                response.last_modified = updated
+            response.cache_control.no_cache = True
+        return response
+    return wrapper
+
+
+def not_modified(etag, updated):
+    response = app.response_class(status=304)
+    response.set_etag(etag)
+    if updated is not None:
+        response.last_modified = updated
+    response.cache_control.no_cache = True
+    return response
+
+
+@app.after_request
+def compress_response(response):
+    """Brotli or gzip compress large responses for clients that accept it."""
+    response.vary.add("Accept-Encoding")
+    if (response.status_code != 200 or response.direct_passthrough
+            or "Content-Encoding" in response.headers):
+        return response
+    body = response.get_data()
+    if len(body) < COMPRESS_MIN_SIZE:
+        return response
+
+    accepted = request.accept_encodings
+    if brotli is not None and accepted["br"]:
+        encoding, body = "br", brotli.compress(body, quality=5)
+    elif accepted["gzip"]:
+        encoding, body = "gzip", gzip.compress(body, compresslevel=6)
+    else:
+        return response
+
+    response.set_data(body)
+    response.headers["Content-Encoding"] = encoding
+    etag, weak = response.get_etag()
+    if etag:
+        response.set_etag(f"{etag}-{encoding}", weak)
+    return response
+
+
+def hour_bucket(timestamp):
+    """Truncate a timestamp to the start of its hour, as a naive UTC datetime (how Mongo stores it)."""
+    if timestamp.tzinfo is not None:
+        timestamp = timestamp.astimezone(timezone.utc).replace(tzinfo=None)
+    return timestamp.replace(minute=0, second=0, microsecond=0)
+
+
+def alert_stats_update(location, timestamp, status_deltas, total=0):
+    """Build the (filter, update) of the rollup of location and the hour of timestamp.
+
+    status_deltas maps status to a count change, e.g. {"new": -1, "resolved": 1}
+    for a status change. total is the change in the number of alerts.
+    Returns None when there is nothing to change.
+    """
+    increments = {f"counts.{status}": delta for status, delta in status_deltas.items() if delta}
+    if total:
+        increments["total"] = total
+    if not increments:
+        return None
+    hour = hour_bucket(timestamp)
+    return (
+        {"_id": {"location": location, "hour": hour}},
+        {"$inc": increments, "$setOnInsert": {"location": location, "hour": hour}},
+    )
+
+
+def bump_alert_stats(location, timestamp, status_deltas, total=0):
+    """Apply count changes to the rollup of location and the hour of timestamp."""
+    update = alert_stats_update(location, timestamp, status_deltas, total)
+    if update is not None:
+        alert_stats_collection.update_one(*update, upsert=True)
+
+
+def rebuild_alert_stats():
+    """Recompute every rollup document from the alerts with one aggregation pipeline.
+
+    Needs MongoDB 5.0 or later for $dateTrunc.
+    """
+    alerts_collection.aggregate([
+        {"$group": {
+            "_id": {
+                "location": "$location",
+                "hour": {"$dateTrunc": {"date": "$timestamp", "unit": "hour"}},
+                "status": "$status",
+            },
+            "count": {"$sum": 1},
+        }},
+        {"$group": {
+            "_id": {"location": "$_id.location", "hour": "$_id.hour"},
+            "location": {"$first": "$_id.location"},
+            "hour": {"$first": "$_id.hour"},
+            "total": {"$sum": "$count"},
+            "counts": {"$push": {"k": "$_id.status", "v": "$count"}},
+        }},
+        {"$set": {"counts": {"$arrayToObject": "$counts"}}},
+        # Replaces the rollup collection in one step once the pipeline has finished
+        {"$out": alert_stats_collection.name},
+    ])
+    # Cached alert reads must not outlive the rollups they were served with
+    bump_alerts_version()
+
+
+@app.cli.command("rebuild-alert-stats")
+def rebuild_alert_stats_command():
+    """Rebuild the alert statistics rollups from scratch."""
+    rebuild_alert_stats()
+    print(f"Rebuilt {alert_stats_collection.count_documents({})} alert statistics buckets")
+
 
 @app.route("/alerts", methods=["POST"])
 def store_alert():
+    """Store one alert, or a JSON list of alerts in one write, skipping ids already stored."""
     try:
         data = request.get_json()
+        alerts = data if isinstance(data, list) else [data]
+        if not alerts:
+            return jsonify({"error": "No alerts given"}), 400
+
+        for alert in alerts:
+            # Validate required fields
+            required_fields = {"id", "timestamp", "imageUrl", "confidence", "location", "status"}
+            if not isinstance(alert, dict) or not required_fields.issubset(alert):
+                return jsonify({"error": "Missing one or more required fields"}), 400
+
+            # They end up in the write filter and the rollup keys, so no operators or lists
+            if not all(isinstance(alert[field], str) for field in ("id", "location", "status")):
+                return jsonify({"error": "id, location and status must be strings"}), 400
 
-        # Validate required fields
-        required_fields = {"id", "timestamp", "imageUrl", "confidence", "location", "status"}
-        if not required_fields.issubset(data):
-            return jsonify({"error": "Missing one or more required fields"}), 400
+            # Ensure status is valid
+            if alert["status"] not in valid_statuses:
+                return jsonify({"error": f"Invalid status: {alert['status']}"}), 400
 
-        # Ensure status is valid
-        valid_statuses = {"new", "reviewing", "resolved", "false-alarm"}
-        if data["status"] not in valid_statuses:
-            return jsonify({"error": f"Invalid status: {data['status']}"}), 400
+            # Parse timestamp
+            try:
+                alert["timestamp"] = datetime.fromisoformat(alert["timestamp"])
+            except Exception:
+                return jsonify({"error": "Invalid timestamp format"}), 400
 
-        # Parse timestamp
+        # Insert into MongoDB. Senders retry failed batches, so an alert whose id
+        # is already stored is skipped instead of stored a second time.
+        ensure_alert_indexes()
+        error = None
         try:
-            data["timestamp"] = datetime.fromisoformat(data["timestamp"])
-        except Exception:
-            return jsonify({"error": "Invalid timestamp format"}), 400
+            result = alerts_collection.bulk_write([
+                UpdateOne({"id": alert["id"]},
+                          {"$setOnInsert": {key: value for key, value in alert.items() if key != "id"}},
+                          upsert=True)
+                for alert in alerts
+            ], ordered=False)
+            inserted = set(result.upserted_ids)
+        except BulkWriteError as e:
+            inserted = {upsert["index"] for upsert in e.details.get("upserted", [])}
+            # Duplicate key errors are two requests racing to insert the same alert
+            if any(write_error["code"] != 11000 for write_error in e.details.get("writeErrors", [])):
+                error = e
+
+        # Count only the alerts this request stored, even if some of its writes failed
+        deltas = {}
+        for index in inserted:
+            alert = alerts[index]
+            bucket = deltas.setdefault((alert["location"], hour_bucket(alert["timestamp"])), {})
+            bucket[alert["status"]] = bucket.get(alert["status"], 0) + 1
+        if deltas:
+            alert_stats_collection.bulk_write([
+                UpdateOne(*alert_stats_update(location, hour, bucket, total=sum(bucket.values())), upsert=True)
+                for (location, hour), bucket in deltas.items()
+            ], ordered=False)
+            bump_alerts_version()
+        if error is not None:
+            raise error
 
-        # Insert into MongoDB
-        alerts_collection.insert_one(data)
-        return jsonify({"message": "Alert stored successfully"}), 201
+        if len(alerts) == 1:
+            if not inserted:
+                return jsonify({"message": "Alert already stored"}), 200
+            return jsonify({"message": "Alert stored successfully"}), 201
+        return jsonify({
+            "message": f"{len(inserted)} alerts stored successfully",
+            "duplicates": len(alerts) - len(inserted),
+        }), 201
 
     except Exception as e:
         traceback.print_exc()
         return jsonify({"error": "Internal Server Error"}), 500
 
 @app.route("/alerts", methods=["GET"])
+@conditional_on_alerts
 def get_alerts():
     try:
         # Fetch all alerts
-        alerts = list(alerts_collection.find())
+        alerts = list(alerts_collection.find({}, {"pendingChanges": 0}))
 
         # Convert ObjectId and datetime to string for JSON serialization
         for alert in alerts:
@@ -67,6 +316,126 @@ def get_alerts():
         traceback.print_exc()
         return jsonify({"error": "Internal Server Error"}), 500
 
+@app.route("/alerts/status", methods=["PATCH"])
+def update_alert_status():
+    """Move a list of alerts to one status in a single bulk write.
+
+    Expects {"ids": [...], "status": "resolved"}. Returns how many alerts
+    changed, the ids already in that status and the ids that do not exist.
+    """
+    try:
+        data = request.get_json(silent=True) or {}
+        ids = data.get("ids")
+        status = data.get("status")
+
+        if not isinstance(ids, list) or not ids or not all(isinstance(alert_id, str) for alert_id in ids):
+            return jsonify({"error": "ids must be a non-empty list of alert ids"}), 400
+        if status not in valid_statuses:
+            return jsonify({"error": f"Invalid status: {status}"}), 400
+
+        ids = list(dict.fromkeys(ids))
+        alerts = list(alerts_collection.find(
+            {"id": {"$in": ids}},
+            {"id": 1, "status": 1, "location": 1, "timestamp": 1},
+        ))
+        found = {alert["id"] for alert in alerts}
+        changing = [alert for alert in alerts if alert["status"] != status]
+
+        modified = 0
+        if changing:
+            # Matching on the old status as well keeps a concurrent change from being
+            # applied twice. Each update also tags the alert with this request's change
+            # id, which tells which of our updates went through if some were skipped.
+            # The tags are removed again below, so changed alerts are left as they were.
+            change = uuid.uuid4().hex
+            result = alerts_collection.bulk_write([
+                UpdateOne({"_id": alert["_id"], "status": alert["status"]}, {
+                    "$set": {"status": status},
+                    "$addToSet": {"pendingChanges": change},
+                })
+                for alert in changing
+            ], ordered=False)
+            modified = result.modified_count
+            if modified < len(changing):
+                applied = {alert["_id"] for alert in alerts_collection.find(
+                    {"_id": {"$in": [alert["_id"] for alert in changing]}, "pendingChanges": change},
+                    {"_id": 1})}
+                changing = [alert for alert in changing if alert["_id"] in applied]
+
+            deltas = {}
+            for alert in changing:
+                key = (alert["location"], hour_bucket(alert["timestamp"]))
+                bucket = deltas.setdefault(key, {})
+                bucket[alert["status"]] = bucket.get(alert["status"], 0) - 1
+                bucket[status] = bucket.get(status, 0) + 1
+            updates = [alert_stats_update(location, hour, bucket) for (location, hour), bucket in deltas.items()]
+            updates = [UpdateOne(*update, upsert=True) for update in updates if update is not None]
+            if updates:
+                alert_stats_collection.bulk_write(updates, ordered=False)
+            # Only now are both the alerts and their rollups current
+            if modified:
+                bump_alerts_version()
+            if changing:
+                changed_ids = [alert["_id"] for alert in changing]
+                alerts_collection.update_many({"_id": {"$in": changed_ids}}, {"$pull": {"pendingChanges": change}})
+                # Unless another change is still in flight, drop the emptied list as well
+                alerts_collection.update_many(
+                    {"_id": {"$in": changed_ids}, "pendingChanges": {"$size": 0}},
+                    {"$unset": {"pendingChanges": ""}},
+                )
+
+        return jsonify({
+            "status": status,
+            "requested": len(ids),
+            "modified": modified,
+            "unchanged": [alert["id"] for alert in alerts if alert["status"] == status],
+            "notFound": [alert_id for alert_id in ids if alert_id not in found],
+        }), 200
+
+    except Exception as e:
+        traceback.print_exc()
+        return jsonify({"error": "Internal Server Error"}), 500
+
+@app.route("/alerts/stats", methods=["GET"])
+@conditional_on_alerts
+def get_alert_stats():
+    """Alert counts by status, location and hour, summed from the rollups.
+
+    Optional query parameters: location, and start/end as ISO timestamps.
+    """
+    try:
+        query = {}
+        if request.args.get("location"):
+            query["location"] = request.args["location"]
+        hour_range = {}
+        try:
+            if request.args.get("start"):
+                hour_range["$gte"] = hour_bucket(datetime.fromisoformat(request.args["start"]))
+            if request.args.get("end"):
+                hour_range["$lte"] = hour_bucket(datetime.fromisoformat(request.args["end"]))
+        except ValueError:
+            return jsonify({"error": "Invalid timestamp format"}), 400
+        if hour_range:
+            query["hour"] = hour_range
+
+        stats = {"total": 0, "byStatus": {}, "byLocation": {}, "byHour": {}}
+        for bucket in alert_stats_collection.find(query):
+            hour = bucket["hour"].isoformat()
+            stats["total"] += bucket.get("total", 0)
+            stats["byLocation"][bucket["location"]] = \
+                stats["byLocation"].get(bucket["location"], 0) + bucket.get("total", 0)
+            hour_stats = stats["byHour"].setdefault(hour, {"total": 0, "byStatus": {}})
+            hour_stats["total"] += bucket.get("total", 0)
+            for status, count in bucket.get("counts", {}).items():
+                stats["byStatus"][status] = stats["byStatus"].get(status, 0) + count
+                hour_stats["byStatus"][status] = hour_stats["byStatus"].get(status, 0) + count
+
+        return jsonify(stats), 200
+
+    except Exception as e:
+        traceback.print_exc()
+        return jsonify({"error": "Internal Server Error"}), 500
+
 # Configure Gemini API
 genai.configure(api_key=os.environ["GOOGLE_API_KEY"])
 
@@ -94,6 +463,42 @@ model = genai.GenerativeModel(
     generation_config=generation_config,
 )
 
+# Streamed warnings start speaking once the first sentence is generated. Requests
+# can ask for either mode with "stream"; this sets the default.
+STREAM_WARNINGS = os.getenv("STREAM_WARNINGS", "0") == "1"
+
+
+def chunk_text(chunk):
+    """Text of a streamed response chunk, or "" for chunks without any.
+
+    Safety and finish chunks carry no text part, and .text raises on them.
+    """
+    try:
+        return chunk.text
+    except (AttributeError, ValueError):
+        return ""
+
+
+def play_audio_files(paths):
+    """Play audio files back to back on one mixer channel.
+
+    Each file is queued behind the one playing, so there is no gap between them.
+    """
+    channel = None
+    for path in paths:
+        sound = pygame.mixer.Sound(path)
+        if channel is not None:
+            # A channel holds one queued sound; wait for it to start playing
+            while channel.get_queue() is not None:
+                pygame.time.Clock().tick(100)
+        if channel is not None and channel.get_busy():
+            channel.queue(sound)
+        else:
+            channel = sound.play()
+    while channel is not None and channel.get_busy():
+        pygame.time.Clock().tick(10)
+
+
 @app.route('/api/generate-warning', methods=['POST'])
 def generate_warning():
     try:
@@ -123,33 +528,70 @@ def generate_warning():
         )
 
         # Start a chat session with image + prompt
-        chat_session = model.start_chat(
-            history=[
-                {
-                    "role": "user",
-                    "parts": [gemini_file, prompt_text]
-                }
-            ]
-        )
-        response = chat_session.send_message("Analyze this image.")
-        warning_message = response.text.strip()
-        print(f"Gemini response: {warning_message}")
+        def start_chat():
+            return model.start_chat(
+                history=[
+                    {
+                        "role": "user",
+                        "parts": [gemini_file, prompt_text]
+                    }
+                ]
+            )
+
+        spoken = None
+        if data.get('stream', STREAM_WARNINGS):
+            # Speak each sentence as soon as it is generated and synthesized
+            def synthesize(sentence, index):
+                audio_file = f"warning_{timestamp}_{index}.mp3"
+                gTTS(text=sentence, lang='en', slow=False).save(audio_file)
+                return audio_file
+
+            received = []
+
+            def texts(response):
+                for chunk in response:
+                    text = chunk_text(chunk)
+                    if text:
+                        received.append(text)
+                        yield text
+
+            try:
+                response = start_chat().send_message("Analyze this image.", stream=True)
+                spoken = SpeechPipeline(synthesize, play_audio_files).speak(texts(response))
+            except Exception as e:
+                if received:
+                    raise
+                # Nothing has been said yet, so answer without streaming instead
+                print(f"Streaming the warning failed, falling back: {e}")
+            if spoken is not None and not spoken["text"]:
+                spoken = None
+
+        if spoken is not None:
+            warning_message = spoken["text"]
+            audio_files = spoken["audioFiles"]
+            print(f"Gemini response: {warning_message}")
+        else:
+            response = start_chat().send_message("Analyze this image.")
+            warning_message = response.text.strip()
+            print(f"Gemini response: {warning_message}")
 
-        # Generate TTS audio
-        audio_file = f"warning_{timestamp}.mp3"
-        tts = gTTS(text=warning_message, lang='en', slow=False)
-        tts.save(audio_file)
+            # Generate TTS audio
+            audio_file = f"warning_{timestamp}.mp3"
+            tts = gTTS(text=warning_message, lang='en', slow=False)
+            tts.save(audio_file)
+            audio_files = [audio_file]
 
-        # Play the warning
-        pygame.mixer.music.load(audio_file)
-        pygame.mixer.music.play()
-        while pygame.mixer.music.get_busy():
-            pygame.time.Clock().tick(10)
+            # Play the warning
+            pygame.mixer.music.load(audio_file)
+            pygame.mixer.music.play()
+            while pygame.mixer.music.get_busy():
+                pygame.time.Clock().tick(10)
 
         return jsonify({
             "success": True,
             "message": warning_message,
-            "audioFile": audio_file
+            "audioFile": audio_files[0] if audio_files else None,
+            "audioFiles": audio_files
         })
 
     except Exception as e:
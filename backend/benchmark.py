@@ -0,0 +1,355 @@
+"""
+Load test and latency benchmark for the backend.
+
+Starts app.py in-process against local stand-ins and drives a weighted mix
+of requests at a fixed concurrency, then reports throughput and
+p50/p95/p99 latency per endpoint.
+
+Stand-ins:
+    MongoDB   mongomock (in memory) by default, or a local mongod with --mongo-uri.
+              mongomock 4.3 needs pymongo < 4.9 for bulk writes, and does not apply
+              concurrent conditional updates atomically; check data consistency
+              under load against a real mongod
+    Gemini    a fake model that answers after --model-latency seconds, streamed
+              in chunks --chunk-latency seconds apart
+    gTTS      writes an empty file after --tts-latency seconds
+    pygame    a silent mixer; playback takes no time
+
+Example:
+    python benchmark.py --concurrency 16 --duration 30 --mix read=60,poll=20,write=15,warning=5
+"""
+
+import argparse
+import base64
+import contextlib
+import io
+import json
+import logging
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+import types
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from urllib.error import HTTPError
+from urllib.request import Request, urlopen
+
+import cv2
+import numpy as np
+
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+
+WARNING_TEXT = (
+    "Attention, person in the red jacket near the bike rack. "
+    "You are being recorded by security cameras. "
+    "Please step away from the bikes now."
+)
+
+LOCATIONS = ["Front Entrance", "Bike Rack North", "Bike Rack South", "Library"]
+
+
+def install_stand_ins(model_latency: float, chunk_latency: float, tts_latency: float):
+    """Put fake google.generativeai, gtts and pygame modules in place before app is imported."""
+
+    class FakeFile:
+        def __init__(self, path):
+            self.display_name = os.path.basename(path)
+            self.uri = f"file://{path}"
+
+    class FakeChunk:
+        def __init__(self, text):
+            self.text = text
+
+    class FakeChat:
+        def send_message(self, message, stream=False):
+            time.sleep(model_latency)
+            if not stream:
+                return FakeChunk(WARNING_TEXT)
+            return self._stream()
+
+        def _stream(self):
+            words = WARNING_TEXT.split(" ")
+            for i in range(0, len(words), 4):
+                if i:
+                    time.sleep(chunk_latency)
+                yield FakeChunk(" ".join(words[i:i + 4]) + " ")
+
+    class FakeModel:
+        def __init__(self, model_name=None, generation_config=None):
+            pass
+
+        def start_chat(self, history=None):
+            return FakeChat()
+
+    genai = types.ModuleType("google.generativeai")
+    genai.configure = lambda **kwargs: None
+    genai.upload_file = lambda path, mime_type=None: FakeFile(path)
+    genai.GenerativeModel = FakeModel
+    google = sys.modules.get("google") or types.ModuleType("google")
+    google.generativeai = genai
+    sys.modules["google"] = google
+    sys.modules["google.generativeai"] = genai
+
+    class FakeTTS:
+        def __init__(self, text, lang="en", slow=False):
+            self.text = text
+
+        def save(self, path):
+            time.sleep(tts_latency)
+            open(path, "wb").close()
+
+    gtts = types.ModuleType("gtts")
+    gtts.gTTS = FakeTTS
+    sys.modules["gtts"] = gtts
+
+    class SilentChannel:
+        def get_busy(self):
+            return False
+
+        def get_queue(self):
+            return None
+
+        def queue(self, sound):
+            pass
+
+    class SilentSound:
+        def __init__(self, path):
+            pass
+
+        def play(self):
+            return SilentChannel()
+
+    class SilentMusic:
+        def load(self, path):
+            pass
+
+        def play(self):
+            pass
+
+        def get_busy(self):
+            return False
+
+    class Clock:
+        def tick(self, framerate=0):
+            return 0
+
+    pygame = types.ModuleType("pygame")
+    pygame.mixer = types.SimpleNamespace(init=lambda: None, music=SilentMusic(), Sound=SilentSound)
+    pygame.time = types.SimpleNamespace(Clock=Clock)
+    sys.modules["pygame"] = pygame
+
+
+def load_app(mongo_uri: str):
+    """Import app.py with the stand-ins and connect it to the chosen MongoDB."""
+    os.environ.setdefault("GOOGLE_API_KEY", "benchmark")
+    if mongo_uri:
+        os.environ["MONGODB_URI"] = mongo_uri
+    sys.path.insert(0, BACKEND_DIR)
+    import app
+
+    if not mongo_uri:
+        try:
+            import mongomock
+        except ImportError:
+            sys.exit("mongomock is not installed. Install it or pass --mongo-uri of a local mongod.")
+        # The client app.py opened on import never connected; hand it the in-memory one instead
+        app.mongo_client.close()
+        app.connect_database(mongomock.MongoClient())
+    return app
+
+
+def new_alert() -> dict:
+    return {
+        "id": f"alert-{uuid.uuid4().hex}",
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "imageUrl": "https://example.com/frame.jpg",
+        "confidence": round(random.uniform(0.3, 0.95), 2),
+        "location": random.choice(LOCATIONS),
+        "status": "new",
+    }
+
+
+class LoadTest:
+    """Drives a weighted mix of requests at the app and records latencies per endpoint."""
+
+    def __init__(self, base_url: str, mix: dict, concurrency: int, duration: float, image_base64: str):
+        self.base_url = base_url
+        self.names = list(mix)
+        self.weights = [mix[name] for name in self.names]
+        self.concurrency = concurrency
+        self.duration = duration
+        self.image_base64 = image_base64
+        self.latencies = {name: [] for name in self.names}
+        self.errors = {name: 0 for name in self.names}
+        self.alert_ids = []
+        self.etag = None
+        self.lock = threading.Lock()
+
+    def request(self, method: str, path: str, body=None, headers=None) -> int:
+        data = json.dumps(body).encode() if body is not None else None
+        headers = dict(headers or {})
+        if data is not None:
+            headers["Content-Type"] = "application/json"
+        headers.setdefault("Accept-Encoding", "gzip")
+        req = Request(self.base_url + path, data=data, headers=headers, method=method)
+        try:
+            with urlopen(req, timeout=60) as response:
+                response.read()
+                if path == "/alerts" and method == "GET":
+                    self.etag = response.headers.get("ETag") or self.etag
+                return response.status
+        except HTTPError as e:
+            e.read()
+            return e.code
+
+    def seed(self, count: int):
+        for _ in range(count):
+            alert = new_alert()
+            self.request("POST", "/alerts", alert)
+            self.alert_ids.append(alert["id"])
+
+    def run_one(self, name: str) -> bool:
+        if name == "read":
+            return self.request("GET", "/alerts") == 200
+        if name == "poll":
+            # A dashboard poll that already has the current list
+            headers = {"If-None-Match": self.etag} if self.etag else {}
+            return self.request("GET", "/alerts", headers=headers) in (200, 304)
+        if name == "stats":
+            return self.request("GET", "/alerts/stats") == 200
+        if name == "write":
+            alert = new_alert()
+            ok = self.request("POST", "/alerts", alert) == 201
+            if ok:
+                with self.lock:
+                    self.alert_ids.append(alert["id"])
+            return ok
+        if name == "status":
+            with self.lock:
+                ids = random.sample(self.alert_ids, min(20, len(self.alert_ids)))
+            status = random.choice(["reviewing", "resolved", "false-alarm"])
+            return self.request("PATCH", "/alerts/status", {"ids": ids, "status": status}) == 200
+        if name == "warning":
+            body = {"imageData": self.image_base64, "cameraId": "benchmark", "stream": True}
+            return self.request("POST", "/api/generate-warning", body) == 200
+        raise ValueError(f"Unknown request type: {name}")
+
+    def worker(self, deadline: float):
+        while time.perf_counter() < deadline:
+            name = random.choices(self.names, self.weights)[0]
+            started = time.perf_counter()
+            try:
+                ok = self.run_one(name)
+            except Exception:
+                ok = False
+            elapsed = time.perf_counter() - started
+            with self.lock:
+                if ok:
+                    self.latencies[name].append(elapsed)
+                else:
+                    self.errors[name] += 1
+
+    def run(self) -> float:
+        started = time.perf_counter()
+        deadline = started + self.duration
+        with ThreadPoolExecutor(max_workers=self.concurrency) as pool:
+            for _ in range(self.concurrency):
+                pool.submit(self.worker, deadline)
+        return time.perf_counter() - started
+
+    def report(self, elapsed: float) -> dict:
+        results = {}
+        all_latencies = []
+        for name in self.names:
+            latencies = np.asarray(self.latencies[name])
+            all_latencies.extend(self.latencies[name])
+            results[name] = summarize(latencies, self.errors[name], elapsed)
+        results["total"] = summarize(np.asarray(all_latencies), sum(self.errors.values()), elapsed)
+        return results
+
+
+def summarize(latencies: np.ndarray, errors: int, elapsed: float) -> dict:
+    summary = {"requests": int(len(latencies)), "errors": errors,
+               "throughput": len(latencies) / elapsed if elapsed else 0.0}
+    for percentile in (50, 95, 99):
+        summary[f"p{percentile}_ms"] = (
+            float(np.percentile(latencies, percentile)) * 1000 if len(latencies) else None)
+    return summary
+
+
+def print_report(results: dict, args):
+    mix = ",".join(f"{name}={weight:g}" for name, weight in args.mix.items())
+    print(f"\nconcurrency {args.concurrency}, {args.duration:.0f}s, mix {mix}")
+    print(f"{'endpoint':<10}{'requests':>10}{'errors':>8}{'req/s':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    for name, summary in results.items():
+        percentiles = "".join(
+            f"{summary[key]:>10.1f}" if summary[key] is not None else f"{'-':>10}"
+            for key in ("p50_ms", "p95_ms", "p99_ms"))
+        print(f"{name:<10}{summary['requests']:>10}{summary['errors']:>8}{summary['throughput']:>10.1f}{percentiles}")
+
+
+REQUEST_TYPES = ("read", "poll", "stats", "write", "status", "warning")
+
+
+def parse_mix(text: str) -> dict:
+    mix = {}
+    for part in text.split(","):
+        name, _, weight = part.partition("=")
+        name = name.strip()
+        if name not in REQUEST_TYPES:
+            raise argparse.ArgumentTypeError(f"Unknown request type: {name}")
+        mix[name] = float(weight or 1)
+    return mix
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--concurrency", type=int, default=8, help="Concurrent clients")
+    parser.add_argument("--duration", type=float, default=20, help="Seconds to run the load")
+    parser.add_argument("--mix", type=parse_mix, default="read=50,poll=20,stats=10,write=15,status=3,warning=2",
+                        help="Weighted request mix of read, poll, stats, write, status and warning")
+    parser.add_argument("--seed-alerts", type=int, default=500, help="Alerts stored before the run")
+    parser.add_argument("--mongo-uri", default="", help="Local mongod to use instead of mongomock")
+    parser.add_argument("--model-latency", type=float, default=0.8, help="Seconds until the fake model answers")
+    parser.add_argument("--chunk-latency", type=float, default=0.1, help="Seconds between streamed chunks")
+    parser.add_argument("--tts-latency", type=float, default=0.2, help="Seconds the fake TTS takes per call")
+    parser.add_argument("--port", type=int, default=5099)
+    parser.add_argument("--json", action="store_true", help="Print the results as JSON")
+    args = parser.parse_args()
+
+    install_stand_ins(args.model_latency, args.chunk_latency, args.tts_latency)
+    app = load_app(args.mongo_uri)
+    from werkzeug.serving import make_server
+
+    # Warning requests leave frames and audio files in the working directory
+    workdir = tempfile.mkdtemp(prefix="watchdocks-benchmark-")
+    os.chdir(workdir)
+
+    # Keep request logs and the app's prints out of the report
+    logging.getLogger("werkzeug").setLevel(logging.ERROR)
+    server = make_server("127.0.0.1", args.port, app.app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    frame = np.random.default_rng(0).integers(0, 255, (720, 1280, 3), dtype=np.uint8)
+    image_base64 = base64.b64encode(cv2.imencode(".jpg", frame, [cv2.IMWRITE_JPEG_QUALITY, 80])[1].tobytes()).decode()
+
+    load = LoadTest(f"http://127.0.0.1:{args.port}", args.mix, args.concurrency, args.duration, image_base64)
+    with contextlib.redirect_stdout(io.StringIO()):
+        load.seed(args.seed_alerts)
+        load.request("GET", "/alerts")
+        elapsed = load.run()
+    server.shutdown()
+
+    results = load.report(elapsed)
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        print_report(results, args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,312 @@
+"""
+Functional checks of the backend against local stand-ins.
+
+Uses the same stand-ins as benchmark.py (mongomock, a fake Gemini, gTTS and
+pygame) and Flask's test client, so it runs without network access or
+credentials. Each check prints its name and PASS or FAIL; the script exits
+with status 1 if any check failed.
+
+Example:
+    python checks.py
+"""
+
+import base64
+import gzip
+import os
+import sys
+import tempfile
+import time
+import traceback
+
+from pymongo.errors import BulkWriteError
+
+from benchmark import WARNING_TEXT, install_stand_ins, load_app, new_alert
+from speech_stream import SpeechPipeline, split_sentences
+
+CHECKS = []
+
+
+def check(function):
+    CHECKS.append(function)
+    return function
+
+
+class SafetyChunk:
+    """A streamed chunk without a text part, like Gemini's safety and finish chunks."""
+
+    @property
+    def text(self):
+        raise ValueError("The response has no text part")
+
+
+class TextChunk:
+    def __init__(self, text):
+        self.text = text
+
+
+class ScriptedChat:
+    def __init__(self, stream):
+        self.stream = stream
+        self.calls = []
+
+    def send_message(self, message, stream=False):
+        self.calls.append(stream)
+        if not stream:
+            return TextChunk(WARNING_TEXT)
+        return self.stream()
+
+
+class ScriptedModel:
+    """Replaces app.model; every chat streams what stream() yields."""
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.chats = []
+
+    def start_chat(self, history=None):
+        chat = ScriptedChat(self.stream)
+        self.chats.append(chat)
+        return chat
+
+    @property
+    def calls(self):
+        return [call for chat in self.chats for call in chat.calls]
+
+
+def post_warning(client, **extra):
+    body = {"imageData": base64.b64encode(b"\xff\xd8 not really a jpeg").decode(), "cameraId": "check"}
+    body.update(extra)
+    return client.post("/api/generate-warning", json=body)
+
+
+@check
+def sentences_survive_chunk_boundaries(app, client):
+    chunks = ["Attention, person in the red ", "jacket. You are being rec", "orded! Please leave now"]
+    sentences = list(split_sentences(chunks))
+    assert sentences == ["Attention, person in the red jacket.", "You are being recorded!",
+                         "Please leave now"], sentences
+
+
+@check
+def speech_starts_before_generation_ends(app, client):
+    played = []
+
+    def chunks():
+        yield "First sentence of the warning. "
+        time.sleep(0.3)
+        yield "Second sentence of the warning."
+
+    def play(paths):
+        for path in paths:
+            played.append((path, time.perf_counter()))
+
+    started = time.perf_counter()
+    result = SpeechPipeline(lambda sentence, index: f"{index}.mp3", play).speak(chunks())
+    assert [path for path, _ in played] == ["0.mp3", "1.mp3"], played
+    assert played[0][1] - started < 0.2, "first sentence waited for the whole response"
+    assert result["audioFiles"] == ["0.mp3", "1.mp3"], result
+
+
+@check
+def warning_is_not_streamed_by_default(app, client):
+    app.model = ScriptedModel(lambda: iter([TextChunk(WARNING_TEXT)]))
+    response = post_warning(client)
+    assert response.status_code == 200, response.get_json()
+    assert app.model.calls == [False], app.model.calls
+    assert response.get_json()["message"] == WARNING_TEXT
+
+
+@check
+def streamed_warning_skips_chunks_without_text(app, client):
+    def stream():
+        yield SafetyChunk()
+        for sentence in WARNING_TEXT.split(". "):
+            yield TextChunk(sentence + ". ")
+        yield SafetyChunk()
+
+    app.model = ScriptedModel(stream)
+    response = post_warning(client, stream=True)
+    data = response.get_json()
+    assert response.status_code == 200, data
+    assert app.model.calls == [True], app.model.calls
+    assert len(data["audioFiles"]) == 3, data
+
+
+@check
+def failed_stream_falls_back_before_speaking(app, client):
+    def stream():
+        raise ConnectionError("stream dropped")
+        yield
+
+    app.model = ScriptedModel(stream)
+    response = post_warning(client, stream=True)
+    data = response.get_json()
+    assert response.status_code == 200, data
+    assert app.model.calls == [True, False], app.model.calls
+    assert data["message"] == WARNING_TEXT
+
+
+@check
+def empty_stream_falls_back(app, client):
+    app.model = ScriptedModel(lambda: iter([SafetyChunk()]))
+    response = post_warning(client, stream=True)
+    assert response.status_code == 200, response.get_json()
+    assert app.model.calls == [True, False], app.model.calls
+
+
+def seed_alerts(client, count=20):
+    alerts = [new_alert() for _ in range(count)]
+    response = client.post("/alerts", json=alerts)
+    assert response.status_code == 201, response.get_json()
+    return alerts
+
+
+@check
+def unchanged_alerts_get_304(app, client):
+    seed_alerts(client)
+    first = client.get("/alerts")
+    etag = first.headers["ETag"]
+    assert first.status_code == 200 and first.headers["Cache-Control"] == "no-cache", first.headers
+    again = client.get("/alerts", headers={"If-None-Match": etag})
+    assert again.status_code == 304 and not again.data, again.status_code
+    assert again.headers["ETag"] == etag, again.headers
+    stats = client.get("/alerts/stats")
+    assert client.get("/alerts/stats", headers={"If-None-Match": stats.headers["ETag"]}).status_code == 304
+
+
+@check
+def writes_change_the_etag(app, client):
+    alerts = seed_alerts(client)
+    etag = client.get("/alerts").headers["ETag"]
+    response = client.patch("/alerts/status", json={"ids": [alerts[0]["id"]], "status": "resolved"})
+    assert response.get_json()["modified"] == 1, response.get_json()
+    after = client.get("/alerts", headers={"If-None-Match": etag})
+    assert after.status_code == 200 and after.headers["ETag"] != etag, after.headers
+    # A status change that changes nothing keeps cached copies valid
+    etag = after.headers["ETag"]
+    client.patch("/alerts/status", json={"ids": [alerts[0]["id"]], "status": "resolved"})
+    assert client.get("/alerts", headers={"If-None-Match": etag}).status_code == 304
+    assert "pendingChanges" not in app.alerts_collection.find_one({"id": alerts[0]["id"]})
+
+
+@check
+def writes_within_the_same_second_are_not_missed(app, client):
+    seed_alerts(client, 1)
+    first = client.get("/alerts")
+    seed_alerts(client, 1)
+    after = client.get("/alerts", headers={"If-Modified-Since": first.headers["Last-Modified"]})
+    assert after.status_code == 200, after.status_code
+    assert len(after.get_json()) == len(first.get_json()) + 1
+
+
+@check
+def version_is_bumped_after_the_rollups(app, client):
+    alerts = seed_alerts(client, 1)
+    order = []
+    bump, bulk_write = app.bump_alerts_version, app.alert_stats_collection.bulk_write
+    app.bump_alerts_version = lambda: (order.append("version"), bump())[1]
+    app.alert_stats_collection.bulk_write = lambda *args, **kwargs: (order.append("rollups"),
+                                                                     bulk_write(*args, **kwargs))[1]
+    try:
+        client.patch("/alerts/status", json={"ids": [alerts[0]["id"]], "status": "reviewing"})
+    finally:
+        app.bump_alerts_version = bump
+        del app.alert_stats_collection.bulk_write
+    assert order == ["rollups", "version"], order
+
+
+def stats_total(client):
+    return client.get("/alerts/stats").get_json()["total"]
+
+
+@check
+def retried_alerts_are_stored_once(app, client):
+    alerts = seed_alerts(client, 5)
+    total = stats_total(client)
+    stored = app.alerts_collection.count_documents({})
+    # A retry of the same batch, plus one alert the first attempt never stored
+    retry = alerts + [new_alert()]
+    response = client.post("/alerts", json=retry)
+    assert response.status_code == 201, response.get_json()
+    assert response.get_json()["duplicates"] == 5, response.get_json()
+    assert app.alerts_collection.count_documents({}) == stored + 1
+    assert stats_total(client) == total + 1, (stats_total(client), total)
+    single = client.post("/alerts", json=alerts[0])
+    assert single.status_code == 200, single.get_json()
+    assert app.alerts_collection.count_documents({}) == stored + 1
+
+
+@check
+def malformed_alerts_write_nothing(app, client):
+    stored = app.alerts_collection.count_documents({})
+    version = app.alerts_version()[0]
+    for field, value in (("id", {"$exists": True}), ("location", ["x"]), ("status", ["new"])):
+        alerts = [new_alert(), dict(new_alert(), **{field: value})]
+        response = client.post("/alerts", json=alerts)
+        assert response.status_code == 400, (field, response.status_code, response.get_json())
+    assert app.alerts_collection.count_documents({}) == stored
+    assert app.alerts_version()[0] == version
+
+
+@check
+def partial_failures_count_the_stored_alerts(app, client):
+    total = stats_total(client)
+    alerts = [new_alert() for _ in range(3)]
+    bulk_write = app.alerts_collection.bulk_write
+
+    def failing_bulk_write(requests, **kwargs):
+        # The second write fails, the other two go through
+        result = bulk_write(requests[:1] + requests[2:], **kwargs)
+        upserted = [{"index": index, "_id": _id} for index, _id in zip((0, 2), result.upserted_ids.values())]
+        raise BulkWriteError({"writeErrors": [{"index": 1, "code": 2, "errmsg": "failed"}], "upserted": upserted})
+
+    app.alerts_collection.bulk_write = failing_bulk_write
+    try:
+        response = client.post("/alerts", json=alerts)
+    finally:
+        del app.alerts_collection.bulk_write
+    assert response.status_code == 500, response.get_json()
+    assert stats_total(client) == total + 2, (stats_total(client), total)
+
+
+@check
+def large_responses_are_gzipped(app, client):
+    seed_alerts(client, 50)
+    plain = client.get("/alerts", headers={"Accept-Encoding": "identity"})
+    assert "Content-Encoding" not in plain.headers, plain.headers
+    packed = client.get("/alerts", headers={"Accept-Encoding": "gzip"})
+    assert packed.headers["Content-Encoding"] == "gzip", packed.headers
+    assert "Accept-Encoding" in packed.headers["Vary"], packed.headers
+    assert gzip.decompress(packed.data) == plain.data
+    # The compressed copy has its own ETag, which still validates
+    etag = packed.headers["ETag"]
+    assert etag == plain.headers["ETag"][:-1] + '-gzip"', (etag, plain.headers["ETag"])
+    cached = client.get("/alerts", headers={"Accept-Encoding": "gzip", "If-None-Match": etag})
+    assert cached.status_code == 304, cached.status_code
+
+
+def main():
+    install_stand_ins(0, 0, 0)
+    app = load_app("")
+    # Warning requests leave frames and audio files in the working directory
+    os.chdir(tempfile.mkdtemp(prefix="watchdocks-checks-"))
+    client = app.app.test_client()
+    model = app.model
+
+    failed = 0
+    for function in CHECKS:
+        try:
+            function(app, client)
+            print(f"PASS {function.__name__}")
+        except Exception:
+            failed += 1
+            print(f"FAIL {function.__name__}")
+            traceback.print_exc(file=sys.stdout)
+        finally:
+            app.model = model
+    print(f"{len(CHECKS) - failed} of {len(CHECKS)} checks passed")
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
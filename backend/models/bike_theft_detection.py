@@ -3,9 +3,14 @@ Bike theft detection model using Roboflow Inference.
 """
 
 from inference import InferencePipeline
+from inference_sdk import InferenceHTTPClient
 import cv2
+import json
 import os
-from typing import Callable, Dict, Any
+import queue
+import threading
+import time
+from typing import Callable, Dict, Any, List, Optional, Sequence, Tuple
 import numpy as np
 from dotenv import load_dotenv
 
@@ -29,6 +34,7 @@ class BikeTheftDetector:
         self.workspace_name = workspace_name
         self.workflow_id = workflow_id
         self.pipeline = None
+        self.client = None
 
     def start_detection(
         self,
@@ -62,6 +68,27 @@ class BikeTheftDetector:
         if self.pipeline:
             self.pipeline.join()
 
+    def detect_batch(self, frames: List[np.ndarray]) -> List[Dict[str, Any]]:
+        """
+        Run the workflow on a batch of in-memory frames.
+
+        Args:
+            frames: BGR frames, as returned by cv2
+
+        Returns:
+            One workflow result dictionary per frame, in order
+        """
+        if self.client is None:
+            self.client = InferenceHTTPClient(
+                api_url=os.getenv("ROBOFLOW_API_URL", "https://detect.roboflow.com"),
+                api_key=self.api_key,
+            )
+        return self.client.run_workflow(
+            workspace_name=self.workspace_name,
+            workflow_id=self.workflow_id,
+            images={"image": frames},
+        )
+
     def _default_sink(self, result: Dict[str, Any], video_frame: np.ndarray):
         """
         Default callback for processing predictions.
@@ -83,6 +110,344 @@ class BikeTheftDetector:
         print(result)  # Log the predictions
 
 
+class BatchedFrameDetector:
+    """
+    Feeds frames that are already in memory to a BikeTheftDetector in batches.
+
+    Producers (e.g. the crawler's grab threads) hand frames over with
+    submit(), which never blocks: when the queue is full the frame is
+    dropped and counted. A single consumer thread collects up to batch_size
+    frames, waiting at most max_wait seconds to fill a batch, and runs them
+    through the detector in one call.
+
+    With camera_key, the detector is a TiledROIDetector and is also handed
+    the camera of every frame, taken from its metadata under camera_key.
+    """
+
+    def __init__(
+        self,
+        detector: BikeTheftDetector,
+        on_prediction: Optional[Callable[[Dict[str, Any], np.ndarray, Dict[str, Any]], None]] = None,
+        batch_size: int = 8,
+        max_queue: int = 64,
+        max_wait: float = 0.5,
+        camera_key: Optional[str] = None,
+    ):
+        """
+        Initialize the batched detector.
+
+        Args:
+            detector: Detector used to run the batches
+            on_prediction: Called with (result, frame, metadata) for every frame
+            batch_size: Maximum number of frames per detector call
+            max_queue: Maximum number of frames waiting for detection
+            max_wait: Seconds to wait for a batch to fill up before running it
+            camera_key: Metadata key of the camera id, for detectors that need it
+        """
+        self.detector = detector
+        self.camera_key = camera_key
+        self.on_prediction = on_prediction or self._default_sink
+        self.batch_size = batch_size
+        self.max_wait = max_wait
+        self.frames = queue.Queue(maxsize=max_queue)
+        self.dropped = 0
+        self.processed = 0
+        # submit() is called from many grab threads at once
+        self.dropped_lock = threading.Lock()
+        self.running = False
+        self.thread = None
+
+    def start(self):
+        """Start the consumer thread."""
+        self.running = True
+        self.thread = threading.Thread(target=self._run, name="detector", daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        """Process the frames still queued, then stop the consumer thread."""
+        self.running = False
+        if self.thread:
+            self.thread.join()
+            self.thread = None
+
+    def submit(self, frame: np.ndarray, metadata: Dict[str, Any]) -> bool:
+        """
+        Queue a frame for detection without blocking.
+
+        Args:
+            frame: BGR frame
+            metadata: Passed back to on_prediction with the result
+
+        Returns:
+            False if the queue was full and the frame was dropped
+        """
+        try:
+            self.frames.put_nowait((frame, metadata))
+            return True
+        except queue.Full:
+            with self.dropped_lock:
+                self.dropped += 1
+            return False
+
+    def _next_batch(self) -> list:
+        try:
+            batch = [self.frames.get(timeout=0.2)]
+        except queue.Empty:
+            return []
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self.frames.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while self.running or not self.frames.empty():
+            batch = self._next_batch()
+            if not batch:
+                continue
+            frames = [frame for frame, _ in batch]
+            try:
+                if self.camera_key is None:
+                    results = self.detector.detect_batch(frames)
+                else:
+                    camera_ids = [metadata.get(self.camera_key) for _, metadata in batch]
+                    results = self.detector.detect_batch(frames, camera_ids)
+            except Exception as e:
+                print(f"Batch detection failed: {e}")
+                continue
+            for result, (frame, metadata) in zip(results, batch):
+                self.on_prediction(result, frame, metadata)
+            self.processed += len(batch)
+
+    def _default_sink(self, result: Dict[str, Any], frame: np.ndarray, metadata: Dict[str, Any]):
+        """
+        Default callback for batched predictions.
+
+        Args:
+            result: Dictionary containing prediction results
+            frame: The frame the prediction was made on
+            metadata: Metadata submitted with the frame
+        """
+        print(metadata, result)
+
+
+def load_dock_polygons(path: str) -> Dict[str, List[List[Tuple[int, int]]]]:
+    """
+    Load per-camera dock polygons from a JSON file.
+
+    The file maps a camera id to a list of polygons, each a list of [x, y]
+    points in frame pixels, e.g. {"241657": [[[410, 300], [900, 310], [880, 520], [400, 500]]]}.
+    """
+    with open(path) as f:
+        return {str(camera_id): [[tuple(point) for point in polygon] for polygon in polygons]
+                for camera_id, polygons in json.load(f).items()}
+
+
+def non_max_suppression(
+    boxes: np.ndarray, scores: np.ndarray, class_ids: np.ndarray, iou_threshold: float = 0.5
+) -> np.ndarray:
+    """
+    Class-aware NMS over all boxes at once, in OpenCV's C++ NMSBoxes.
+
+    Boxes are shifted apart per class so that boxes of different classes
+    never overlap, so one NMSBoxes call handles every class. Boxes with a
+    score of 0 are dropped.
+
+    Returns:
+        Indices of the boxes to keep, highest score first
+    """
+    if len(boxes) == 0:
+        return np.empty(0, dtype=int)
+    offset = (boxes.max() - boxes.min() + 1) * class_ids[:, None]
+    shifted = boxes + offset
+    rects = np.column_stack([shifted[:, :2], shifted[:, 2:] - shifted[:, :2]])
+    keep = cv2.dnn.NMSBoxes(rects.tolist(), scores.tolist(), 0.0, iou_threshold)
+    return np.asarray(keep, dtype=int).reshape(-1)
+
+
+class TiledROIDetector:
+    """
+    Slices only the dock region of a frame into tiles and detects on those.
+
+    Full-frame slicing (the small-object-detection-sahi-2 workflow) runs the
+    model on every tile, sky and road included. Here each camera has dock
+    polygons; the frame is covered with overlapping tiles of tile_size
+    pixels, and only tiles that overlap a polygon are kept. The tile layout
+    depends only on the camera and the frame size, so it is computed once
+    and cached. All tiles of a batch of frames go to the detector in one
+    call, and detections from overlapping tiles are merged with NMS. A
+    detection counts when its box overlaps the dock by at least
+    min_overlap of its area, so a person standing next to the racks is
+    kept even when the centre of their box is outside the polygon.
+
+    The wrapped detector should run a plain (non-SAHI) detection workflow,
+    since the tiling happens here. Its predictions are read from the
+    output_key output of the workflow.
+    """
+
+    def __init__(
+        self,
+        detector: BikeTheftDetector,
+        dock_polygons: Dict[str, Sequence[Sequence[Tuple[int, int]]]],
+        tile_size: int = 640,
+        overlap: float = 0.2,
+        iou_threshold: float = 0.5,
+        min_overlap: float = 0.0,
+        output_key: str = "predictions",
+    ):
+        """
+        Initialize the tiled detector.
+
+        Args:
+            detector: Detector that runs the tiles
+            dock_polygons: Camera id to dock polygons, in frame pixels
+            tile_size: Width and height of a tile in pixels
+            overlap: Fraction of a tile shared with its neighbours
+            iou_threshold: IoU above which overlapping detections of a class are merged
+            min_overlap: Fraction of a detection's box that must lie on the dock; 0 keeps any overlap
+            output_key: Name of the workflow output that holds the detections
+        """
+        self.detector = detector
+        self.dock_polygons = dock_polygons
+        self.tile_size = tile_size
+        self.overlap = overlap
+        self.iou_threshold = iou_threshold
+        self.min_overlap = min_overlap
+        self.output_key = output_key
+        self.layouts: Dict[Tuple[str, Tuple[int, int]], Tuple[np.ndarray, np.ndarray]] = {}
+        self.lock = threading.Lock()
+
+    def _positions(self, start: int, end: int, limit: int) -> List[int]:
+        """Tile origins covering [start, end) along one axis, kept inside [0, limit)."""
+        size = min(self.tile_size, limit)
+        stride = max(1, int(size * (1 - self.overlap)))
+        positions = list(range(start, max(start, end - size) + 1, stride))
+        if positions[-1] + size < end:
+            positions.append(end - size)
+        return sorted({min(max(0, position), limit - size) for position in positions})
+
+    def tile_layout(self, camera_id: str, frame_shape: Tuple[int, ...]) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Return the tiles of a camera as an (N, 4) array of x1, y1, x2, y2, and the
+        summed-area table of its dock mask.
+
+        Cameras without dock polygons get full-frame tiles.
+        """
+        height, width = frame_shape[:2]
+        key = (camera_id, (height, width))
+        with self.lock:
+            layout = self.layouts.get(key)
+            if layout is not None:
+                return layout
+
+        mask = np.zeros((height, width), dtype=np.uint8)
+        polygons = self.dock_polygons.get(camera_id)
+        if polygons:
+            cv2.fillPoly(mask, [np.asarray(polygon, dtype=np.int32) for polygon in polygons], 1)
+        else:
+            mask[:] = 1
+        ys, xs = np.nonzero(mask)
+        # Summed-area table: the dock pixels inside any tile or box in O(1)
+        integral = cv2.integral(mask)
+        tiles = []
+        if len(xs):
+            size_x, size_y = min(self.tile_size, width), min(self.tile_size, height)
+            for y in self._positions(int(ys.min()), int(ys.max()) + 1, height):
+                for x in self._positions(int(xs.min()), int(xs.max()) + 1, width):
+                    covered = (integral[y + size_y, x + size_x] - integral[y, x + size_x]
+                               - integral[y + size_y, x] + integral[y, x])
+                    if covered > 0:
+                        tiles.append((x, y, x + size_x, y + size_y))
+        layout = (np.asarray(tiles, dtype=np.int32).reshape(-1, 4), integral)
+        with self.lock:
+            self.layouts[key] = layout
+        return layout
+
+    def _tile_predictions(self, result: Dict[str, Any]) -> List[Dict[str, Any]]:
+        """Pull the prediction list out of the output_key output of a workflow result."""
+        if self.output_key not in result:
+            raise KeyError(f"Workflow result has no {self.output_key!r} output, only {sorted(result)}")
+        output = result[self.output_key]
+        # Detections are serialized as {"image": {...}, "predictions": [...]}
+        return output["predictions"] if isinstance(output, dict) else output
+
+    def _on_dock(self, boxes: np.ndarray, integral: np.ndarray) -> np.ndarray:
+        """Indices of the boxes that overlap the dock by at least min_overlap of their area."""
+        height, width = integral.shape[0] - 1, integral.shape[1] - 1
+        x1 = np.clip(np.floor(boxes[:, 0]).astype(int), 0, width)
+        y1 = np.clip(np.floor(boxes[:, 1]).astype(int), 0, height)
+        x2 = np.clip(np.ceil(boxes[:, 2]).astype(int), 0, width)
+        y2 = np.clip(np.ceil(boxes[:, 3]).astype(int), 0, height)
+        covered = integral[y2, x2] - integral[y1, x2] - integral[y2, x1] + integral[y1, x1]
+        areas = np.prod(boxes[:, 2:] - boxes[:, :2], axis=1)
+        return np.nonzero((covered > 0) & (covered >= self.min_overlap * areas))[0]
+
+    def _merge(self, tiles: np.ndarray, integral: np.ndarray, results: List[Dict[str, Any]]) -> Dict[str, Any]:
+        """Turn the tile results of one frame into its predictions in frame coordinates."""
+        boxes, scores, classes = [], [], []
+        for (x1, y1, _, _), result in zip(tiles, results):
+            for prediction in self._tile_predictions(result):
+                cx, cy = prediction["x"] + x1, prediction["y"] + y1
+                half_w, half_h = prediction["width"] / 2, prediction["height"] / 2
+                boxes.append((cx - half_w, cy - half_h, cx + half_w, cy + half_h))
+                scores.append(prediction["confidence"])
+                classes.append(prediction["class"])
+        if not boxes:
+            return {"predictions": [], "tiles": len(tiles)}
+
+        boxes = np.asarray(boxes, dtype=np.float64)
+        scores = np.asarray(scores, dtype=np.float64)
+        class_names, class_ids = np.unique(np.asarray(classes), return_inverse=True)
+
+        on_dock = self._on_dock(boxes, integral)
+        keep = on_dock[non_max_suppression(boxes[on_dock], scores[on_dock], class_ids[on_dock],
+                                           self.iou_threshold)]
+        predictions = []
+        for i in keep:
+            x1, y1, x2, y2 = boxes[i]
+            predictions.append({
+                "x": float((x1 + x2) / 2),
+                "y": float((y1 + y2) / 2),
+                "width": float(x2 - x1),
+                "height": float(y2 - y1),
+                "confidence": float(scores[i]),
+                "class": str(class_names[class_ids[i]]),
+            })
+        return {"predictions": predictions, "tiles": len(tiles)}
+
+    def detect_batch(self, frames: List[np.ndarray], camera_ids: Sequence[str]) -> List[Dict[str, Any]]:
+        """
+        Detect objects in the dock region of several frames, all their tiles in one detector call.
+
+        Args:
+            frames: BGR frames
+            camera_ids: Camera of each frame, which selects its dock polygons
+
+        Returns:
+            One {"predictions": [...], "tiles": number of tiles run} per frame,
+            where each prediction has x, y (centre), width, height, confidence
+            and class in frame coordinates, like the workflow output
+        """
+        layouts = [self.tile_layout(str(camera_id), frame.shape) for frame, camera_id in zip(frames, camera_ids)]
+        crops = [frame[y1:y2, x1:x2] for frame, (tiles, _) in zip(frames, layouts) for x1, y1, x2, y2 in tiles]
+        results = self.detector.detect_batch(crops) if crops else []
+        merged = []
+        start = 0
+        for tiles, integral in layouts:
+            merged.append(self._merge(tiles, integral, results[start:start + len(tiles)]))
+            start += len(tiles)
+        return merged
+
+    def detect(self, camera_id: str, frame: np.ndarray) -> Dict[str, Any]:
+        """Detect objects in the dock region of one frame; see detect_batch."""
+        return self.detect_batch([frame], [camera_id])[0]
+
+
 if __name__ == "__main__":
     detector = BikeTheftDetector(
         workspace_name="bike-theft-detection",
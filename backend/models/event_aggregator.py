@@ -0,0 +1,319 @@
+"""
+Turns per-frame detector predictions into one alert per incident.
+"""
+
+import base64
+import json
+import queue
+import threading
+import time
+import uuid
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from urllib.request import Request, urlopen
+
+import numpy as np
+
+
+def frame_predictions(result: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """Pull the prediction list out of a workflow result or a TiledROIDetector result."""
+    predictions = result.get("predictions", [])
+    if isinstance(predictions, dict):
+        predictions = predictions.get("predictions", [])
+    return predictions
+
+
+def jpeg_data_url(jpeg: bytes) -> str:
+    """Embed JPEG bytes in an alert's imageUrl as a data URL."""
+    return "data:image/jpeg;base64," + base64.b64encode(jpeg).decode()
+
+
+class Track:
+    """Hysteresis state of one track (or one class, when the detector does not track)."""
+
+    def __init__(self):
+        self.hits = 0
+        self.confirmed = False
+        self.last_seen = 0.0
+
+
+class Incident:
+    """An open incident of one camera: from its first confirmed track until all tracks go quiet."""
+
+    def __init__(self, camera_id: str, started: float):
+        self.id = f"alert-{uuid.uuid4().hex}"
+        self.camera_id = camera_id
+        self.started = started
+        self.last_seen = started
+        self.frames = 0
+        self.tracks = set()
+        self.confidence = 0.0
+        self.keyframe: Optional[np.ndarray] = None
+        self.keyframe_time = started
+
+
+class EventAggregator:
+    """
+    Aggregates per-frame predictions into incidents with hysteresis.
+
+    Per camera and per track (tracker_id when the detector provides one,
+    otherwise the class), a track is confirmed after open_hits consecutive
+    frames with a detection of at least open_confidence. Once confirmed it
+    is kept alive by detections of at least keep_confidence, a lower bar,
+    so a flickering detection does not split an incident. A camera's
+    incident opens with its first confirmed track and closes when none of
+    its tracks has been seen for close_after seconds. Only the frame with
+    the best confidence is kept, and each incident becomes a single alert.
+    """
+
+    def __init__(
+        self,
+        on_alert: Callable[[Dict[str, Any]], None],
+        keyframe_url: Callable[[np.ndarray], str],
+        open_hits: int = 3,
+        open_confidence: float = 0.6,
+        keep_confidence: float = 0.4,
+        close_after: float = 30.0,
+        classes: Optional[List[str]] = None,
+        locations: Optional[Dict[str, str]] = None,
+    ):
+        """
+        Initialize the aggregator.
+
+        Args:
+            on_alert: Called with the alert document of every closed incident
+            keyframe_url: Turns the keyframe into the alert's imageUrl, e.g. jpeg_data_url of the encoded frame
+            open_hits: Consecutive detecting frames that confirm a track
+            open_confidence: Minimum confidence of the detections that confirm a track
+            keep_confidence: Minimum confidence of the detections that keep a confirmed track alive
+            close_after: Seconds without detections after which a track, and an incident without tracks, closes
+            classes: Classes that count; None for all
+            locations: Camera id to the location stored on the alert; defaults to the camera id
+        """
+        self.on_alert = on_alert
+        self.open_hits = open_hits
+        self.open_confidence = open_confidence
+        self.keep_confidence = keep_confidence
+        self.close_after = close_after
+        self.classes = set(classes) if classes else None
+        self.locations = locations or {}
+        self.keyframe_url = keyframe_url
+        self.tracks: Dict[Tuple[str, Any], Track] = {}
+        self.incidents: Dict[str, Incident] = {}
+        self.lock = threading.Lock()
+
+    def update(self, camera_id: str, result: Dict[str, Any], frame: np.ndarray, timestamp: Optional[float] = None):
+        """
+        Feed the predictions of one frame.
+
+        Args:
+            camera_id: Camera the frame came from
+            result: Prediction result of the frame
+            frame: The frame, kept if it becomes the incident's keyframe
+            timestamp: Unix time of the frame; defaults to now
+        """
+        now = time.time() if timestamp is None else timestamp
+        camera_id = str(camera_id)
+        best: Dict[Any, float] = {}
+        for prediction in frame_predictions(result):
+            if self.classes is not None and prediction.get("class") not in self.classes:
+                continue
+            key = prediction.get("tracker_id", prediction.get("class"))
+            best[key] = max(best.get(key, 0.0), float(prediction.get("confidence", 0.0)))
+
+        closed = []
+        with self.lock:
+            seen = set()
+            confirmed = {}
+            for key, confidence in best.items():
+                track = self.tracks.setdefault((camera_id, key), Track())
+                if track.confirmed:
+                    if confidence < self.keep_confidence:
+                        continue
+                elif confidence >= self.open_confidence:
+                    track.hits += 1
+                    track.confirmed = track.hits >= self.open_hits
+                else:
+                    track.hits = 0
+                    continue
+                track.last_seen = now
+                seen.add(key)
+                if track.confirmed:
+                    confirmed[key] = confidence
+            if confirmed:
+                self._update_incident(camera_id, confirmed, frame, now)
+            # Unconfirmed tracks must be seen in consecutive frames
+            for (track_camera, key), track in self.tracks.items():
+                if track_camera == camera_id and not track.confirmed and key not in seen:
+                    track.hits = 0
+            closed = self._expire(now)
+        for incident in closed:
+            self.on_alert(self.alert(incident))
+
+    def on_prediction(self, result: Dict[str, Any], frame: np.ndarray, metadata: Dict[str, Any]):
+        """BatchedFrameDetector callback; metadata carries cameraID and an ISO timestamp."""
+        timestamp = metadata.get("timestamp")
+        if isinstance(timestamp, str):
+            timestamp = datetime.fromisoformat(timestamp).timestamp()
+        self.update(metadata.get("cameraID", "unknown"), result, frame, timestamp)
+
+    def _update_incident(self, camera_id: str, confirmed: Dict[Any, float], frame: np.ndarray, now: float):
+        incident = self.incidents.get(camera_id)
+        if incident is None:
+            incident = Incident(camera_id, now)
+            self.incidents[camera_id] = incident
+        incident.last_seen = max(incident.last_seen, now)
+        incident.frames += 1
+        incident.tracks.update(confirmed)
+        confidence = max(confirmed.values())
+        if confidence > incident.confidence:
+            # Copy: the caller may reuse the frame buffer
+            incident.confidence = confidence
+            incident.keyframe = frame.copy()
+            incident.keyframe_time = now
+
+    def _expire(self, now: float) -> List[Incident]:
+        """Drop quiet tracks and return the incidents that closed."""
+        stale = [key for key, track in self.tracks.items() if now - track.last_seen > self.close_after]
+        for key in stale:
+            del self.tracks[key]
+        closed = [incident for camera_id, incident in self.incidents.items()
+                  if now - incident.last_seen > self.close_after]
+        for incident in closed:
+            del self.incidents[incident.camera_id]
+        return closed
+
+    def flush(self, now: Optional[float] = None, close_all: bool = False):
+        """Close incidents that went quiet by now, or all open incidents with close_all."""
+        now = time.time() if now is None else now
+        with self.lock:
+            if close_all:
+                closed = list(self.incidents.values())
+                self.incidents.clear()
+                self.tracks.clear()
+            else:
+                closed = self._expire(now)
+        for incident in closed:
+            self.on_alert(self.alert(incident))
+
+    def alert(self, incident: Incident) -> Dict[str, Any]:
+        """Build the alert document of a closed incident, in the schema POST /alerts expects."""
+        return {
+            "id": incident.id,
+            "timestamp": datetime.fromtimestamp(incident.keyframe_time, timezone.utc).isoformat(),
+            "imageUrl": self.keyframe_url(incident.keyframe),
+            "confidence": round(incident.confidence, 4),
+            "location": self.locations.get(incident.camera_id, incident.camera_id),
+            "status": "new",
+            "cameraId": incident.camera_id,
+            "startedAt": datetime.fromtimestamp(incident.started, timezone.utc).isoformat(),
+            "endedAt": datetime.fromtimestamp(incident.last_seen, timezone.utc).isoformat(),
+            "frames": incident.frames,
+            "tracks": len(incident.tracks),
+        }
+
+
+def post_alerts(url: str, timeout: float = 10) -> Callable[[List[Dict[str, Any]]], None]:
+    """Return a batch writer that sends alerts to the backend's POST /alerts as one JSON list."""
+
+    def write(alerts: List[Dict[str, Any]]):
+        request = Request(url, data=json.dumps(alerts).encode(),
+                          headers={"Content-Type": "application/json"}, method="POST")
+        with urlopen(request, timeout=timeout) as response:
+            response.read()
+
+    return write
+
+
+class BatchedAlertWriter:
+    """
+    Collects alerts and hands them to write_batch in groups.
+
+    A writer thread waits up to max_wait seconds for batch_size alerts and
+    writes them in one call, e.g. one insert_many or one POST of a list.
+    Failed batches are retried up to retries times before they are dropped.
+    """
+
+    def __init__(
+        self,
+        write_batch: Callable[[List[Dict[str, Any]]], None],
+        batch_size: int = 50,
+        max_wait: float = 2.0,
+        retries: int = 3,
+    ):
+        """
+        Initialize the writer.
+
+        Args:
+            write_batch: Called with a list of alert documents
+            batch_size: Maximum number of alerts per write
+            max_wait: Seconds to wait for a batch to fill up before writing it
+            retries: Attempts per batch before it is dropped
+        """
+        self.write_batch = write_batch
+        self.batch_size = batch_size
+        self.max_wait = max_wait
+        self.retries = retries
+        self.alerts = queue.Queue()
+        self.written = 0
+        self.dropped = 0
+        self.running = False
+        self.thread = None
+
+    def start(self):
+        """Start the writer thread."""
+        self.running = True
+        self.thread = threading.Thread(target=self._run, name="alert-writer", daemon=True)
+        self.thread.start()
+
+    def stop(self, timeout: Optional[float] = None):
+        """
+        Write the alerts still queued, then stop the writer thread.
+
+        Args:
+            timeout: Seconds to wait for the queue to drain. Alerts still
+                queued after that are counted as dropped; the writer thread
+                is a daemon and dies with the process.
+        """
+        self.running = False
+        if self.thread:
+            self.thread.join(timeout)
+            if self.thread.is_alive():
+                self.dropped += self.alerts.qsize()
+            self.thread = None
+
+    def submit(self, alert: Dict[str, Any]):
+        """Queue an alert for writing."""
+        self.alerts.put(alert)
+
+    def _next_batch(self) -> list:
+        try:
+            batch = [self.alerts.get(timeout=0.2)]
+        except queue.Empty:
+            return []
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0 or not self.running:
+                break
+            try:
+                batch.append(self.alerts.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while self.running or not self.alerts.empty():
+            batch = self._next_batch()
+            if not batch:
+                continue
+            for attempt in range(self.retries):
+                try:
+                    self.write_batch(batch)
+                    self.written += len(batch)
+                    break
+                except Exception as e:
+                    print(f"Writing {len(batch)} alerts failed (attempt {attempt + 1}): {e}")
+                    time.sleep(min(2 ** attempt, 10))
+            else:
+                self.dropped += len(batch)
@@ -0,0 +1,144 @@
+"""
+Speak a streamed model response sentence by sentence.
+
+The response is cut at sentence boundaries as it arrives. Each sentence is
+synthesized on a worker thread while the model is still generating the
+next one, and the audio is handed to a player in order, so playback starts
+after the first sentence instead of after the whole response.
+
+The model stream, the synthesizer and the player are plain callables, so
+local stand-ins can replace Gemini, gTTS and the audio device.
+"""
+
+import queue
+import re
+import threading
+from typing import Any, Callable, Dict, Iterable, Iterator, List
+
+# End of a sentence: terminal punctuation, optional closing quotes or brackets, then whitespace
+SENTENCE_END = re.compile(r"[.!?]+[\"')\]]*\s+")
+
+
+def split_sentences(chunks: Iterable[str], min_length: int = 20) -> Iterator[str]:
+    """
+    Re-cut streamed text chunks into sentences.
+
+    Args:
+        chunks: Text fragments in the order they were generated
+        min_length: Sentences shorter than this are joined with the next one,
+            so very short fragments don't each pay the synthesis overhead
+
+    Yields:
+        Stripped sentences; whatever is left when the stream ends comes last
+    """
+    pending = ""
+    for chunk in chunks:
+        pending += chunk
+        start = 0
+        for match in SENTENCE_END.finditer(pending):
+            if match.end() - start < min_length:
+                continue
+            sentence = pending[start:match.end()].strip()
+            start = match.end()
+            if sentence:
+                yield sentence
+        pending = pending[start:]
+    if pending.strip():
+        yield pending.strip()
+
+
+class SpeechPipeline:
+    """
+    Synthesizes sentences on a worker thread and plays them in order.
+
+    Synthesis of sentence n+1 overlaps with playback of sentence n and with
+    generation of the sentences after it.
+    """
+
+    _DONE = object()
+
+    def __init__(
+        self,
+        synthesize: Callable[[str, int], str],
+        play: Callable[[Iterator[str]], None],
+        max_ahead: int = 4,
+    ):
+        """
+        Initialize the pipeline.
+
+        Args:
+            synthesize: Called with (sentence, index); returns the path of the audio file
+            play: Called once with an iterator of audio paths; plays them back to back
+                and returns when the iterator is exhausted and playback has finished
+            max_ahead: Maximum number of sentences waiting for synthesis
+        """
+        self.synthesize = synthesize
+        self.play = play
+        self.max_ahead = max_ahead
+
+    def speak(self, chunks: Iterable[str]) -> Dict[str, Any]:
+        """
+        Speak a stream of text chunks.
+
+        Returns:
+            Dictionary with the full "text" and the "audioFiles" in playback order
+        """
+        sentences = queue.Queue(maxsize=self.max_ahead)
+        audio = queue.Queue()
+        audio_files: List[str] = []
+        errors: List[BaseException] = []
+
+        def synthesize_all():
+            index = 0
+            try:
+                while True:
+                    sentence = sentences.get()
+                    if sentence is self._DONE:
+                        break
+                    path = self.synthesize(sentence, index)
+                    audio_files.append(path)
+                    audio.put(path)
+                    index += 1
+            except BaseException as e:
+                errors.append(e)
+                # Keep draining so the producer never blocks on a full queue
+                while sentences.get() is not self._DONE:
+                    pass
+            finally:
+                audio.put(self._DONE)
+
+        def audio_paths():
+            while True:
+                path = audio.get()
+                if path is self._DONE:
+                    return
+                yield path
+
+        def play_all():
+            paths = audio_paths()
+            try:
+                self.play(paths)
+            except BaseException as e:
+                errors.append(e)
+                # Let the synthesizer finish instead of waiting on a dead player
+                for _ in paths:
+                    pass
+
+        synthesizer = threading.Thread(target=synthesize_all, name="tts", daemon=True)
+        player = threading.Thread(target=play_all, name="player", daemon=True)
+        synthesizer.start()
+        player.start()
+
+        text = []
+        try:
+            for sentence in split_sentences(chunks):
+                text.append(sentence)
+                sentences.put(sentence)
+        finally:
+            sentences.put(self._DONE)
+            synthesizer.join()
+            player.join()
+
+        if errors:
+            raise errors[0]
+        return {"text": " ".join(text), "audioFiles": audio_files}
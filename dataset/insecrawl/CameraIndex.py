@@ -0,0 +1,95 @@
+import os
+import re
+import sqlite3
+import threading
+
+
+class CameraIndex(object):
+    """Persistent index of the cameras that have a still saved in a folder.
+
+    Maps camera id to the time, path and hash of its last capture. Captures
+    that were not written because they matched the previous frame only move
+    the capture time forward; the CaptureLog of the folder has every one of
+    them. The index is a SQLite file inside the download folder. It is read
+    into memory once when opened, so lookups never touch the disk. Stored
+    captures are committed as they happen, duplicate ones with the next
+    stored capture or on close.
+    """
+
+    fileName = '.camera_index.sqlite'
+    # Matches images saved as [ID]_[YYYY-MM-DD]_[HH-MM-SS].jpg or [ID]_.jpg
+    imagePattern = re.compile(r'^\[([^\]]+)\]_.*\.jpg$')
+
+    def __init__(self, folder):
+        self.folder = folder
+        self.path = os.path.join(folder, self.fileName)
+        self.lock = threading.Lock()
+        isNew = not os.path.exists(self.path)
+        self.db = sqlite3.connect(self.path, check_same_thread=False)
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.execute('PRAGMA synchronous=NORMAL')
+        self.db.execute('CREATE TABLE IF NOT EXISTS cameras ('
+                        'id TEXT PRIMARY KEY, captured REAL, path TEXT, hash TEXT)')
+        # Indexes from before the CaptureLog kept every duplicate capture here too
+        self.db.execute('DROP TABLE IF EXISTS refs')
+        self.cameras = {row[0]: row[1:] for row in
+                        self.db.execute('SELECT id, captured, path, hash FROM cameras')}
+        if isNew:
+            self.seed()
+
+    def seed(self):
+        """Index images that were saved before the index existed. Runs once per folder."""
+        rows = []
+        for entry in os.scandir(self.folder):
+            if entry.is_dir():
+                # Hidden folders hold the smaller tiers and the capture log
+                if entry.name.startswith('.'):
+                    continue
+                # --sortByCamera keeps each camera in its own folder
+                for image in os.scandir(entry.path):
+                    match = self.imagePattern.match(image.name)
+                    if match and image.is_file():
+                        rows.append((match.group(1), image.stat().st_mtime, image.path, None))
+                continue
+            match = self.imagePattern.match(entry.name)
+            if match:
+                rows.append((match.group(1), entry.stat().st_mtime, entry.path, None))
+        # Keep the most recent capture of every camera
+        rows.sort(key=lambda row: row[1])
+        with self.lock:
+            for row in rows:
+                self.cameras[row[0]] = row[1:]
+            self.db.executemany('INSERT OR REPLACE INTO cameras VALUES (?, ?, ?, ?)',
+                                [(cameraID,) + details for cameraID, details in self.cameras.items()])
+            self.db.commit()
+
+    def __contains__(self, cameraID):
+        return cameraID in self.cameras
+
+    def cameraIDs(self):
+        """Return the ids of every camera in the index."""
+        with self.lock:
+            return list(self.cameras)
+
+    def get(self, cameraID):
+        """Return (captured, path, hash) of the last capture of cameraID, or None."""
+        return self.cameras.get(cameraID)
+
+    def record(self, cameraID, captured, path, imageHash):
+        with self.lock:
+            self.cameras[cameraID] = (captured, path, imageHash)
+            self.db.execute('INSERT OR REPLACE INTO cameras VALUES (?, ?, ?, ?)',
+                            (cameraID, captured, path, imageHash))
+            self.db.commit()
+
+    def recordReference(self, cameraID, captured):
+        """Record a capture of cameraID that is a duplicate of its last stored image."""
+        with self.lock:
+            _, path, imageHash = self.cameras[cameraID]
+            self.cameras[cameraID] = (captured, path, imageHash)
+            self.db.execute('UPDATE cameras SET captured = ? WHERE id = ?', (captured, cameraID))
+
+    def close(self):
+        with self.lock:
+            self.db.commit()
+            self.db.close()
@@ -0,0 +1,172 @@
+from array import array
+import os
+import threading
+import time
+
+import numpy as np
+
+
+class CaptureLog(object):
+    """Append-only columnar log of capture records for a download folder.
+
+    Every record is (camera id, timestamp, path, size, hash, success). Each
+    column is its own file of fixed-width values under {folder}/.captures/;
+    camera ids are dictionary encoded and paths are stored as one blob plus
+    an end offset column. Records are buffered and flushed in blocks of
+    flushEvery records, or flushSeconds after the previous flush, whichever
+    comes first.
+
+    query() answers "frames of camera X between T1 and T2" with a few
+    vectorized comparisons over the loaded columns, instead of listing the
+    folder and parsing every file name.
+
+    Opened with readOnly (e.g. by vidmaker.py while a crawl is running),
+    nothing is repaired or written: a block the crawler is halfway through
+    flushing is simply left out of what is loaded.
+    """
+
+    dirName = '.captures'
+    columns = {'camera': 'I', 'timestamp': 'd', 'size': 'Q', 'hash': 'Q',
+               'success': 'B', 'pathEnd': 'Q'}
+    numpyTypes = {'I': np.uint32, 'd': np.float64, 'Q': np.uint64, 'B': np.uint8}
+
+    def __init__(self, folder, flushEvery=256, flushSeconds=30, readOnly=False):
+        self.folder = folder
+        self.path = os.path.join(folder, self.dirName)
+        self.readOnly = readOnly
+        if not readOnly:
+            os.makedirs(self.path, exist_ok=True)
+        self.flushEvery = flushEvery
+        self.flushSeconds = flushSeconds
+        self.lastFlush = time.monotonic()
+        self.lock = threading.Lock()
+        self.cameraCodes = {}
+        self.cameraFile = os.path.join(self.path, 'cameras.txt')
+        if os.path.exists(self.cameraFile):
+            with open(self.cameraFile) as cameras:
+                for code, cameraID in enumerate(cameras.read().splitlines()):
+                    self.cameraCodes[cameraID] = code
+        self.pathBytes = 0 if readOnly else self.repair()
+        self.buffers = {name: array(typecode) for name, typecode in self.columns.items()}
+        self.pathBuffer = bytearray()
+        self.loaded = None
+
+    def columnFile(self, name):
+        return os.path.join(self.path, name + '.col')
+
+    def repair(self):
+        """Cut every column back to the shortest one, dropping a partially flushed block.
+
+        Returns the length of the path blob."""
+        lengths = []
+        for name, typecode in self.columns.items():
+            try:
+                lengths.append(os.path.getsize(self.columnFile(name)) // array(typecode).itemsize)
+            except OSError:
+                lengths.append(0)
+        records = min(lengths)
+        for name, typecode in self.columns.items():
+            with open(self.columnFile(name), 'ab') as column:
+                column.truncate(records * array(typecode).itemsize)
+        pathEnd = np.fromfile(self.columnFile('pathEnd'), dtype=np.uint64)
+        pathBytes = int(pathEnd[-1]) if len(pathEnd) else 0
+        with open(os.path.join(self.path, 'paths.blob'), 'ab') as paths:
+            paths.truncate(pathBytes)
+        return pathBytes
+
+    def cameraCode(self, cameraID):
+        code = self.cameraCodes.get(cameraID)
+        if code is None:
+            code = len(self.cameraCodes)
+            self.cameraCodes[cameraID] = code
+            with open(self.cameraFile, 'a') as cameras:
+                cameras.write(cameraID + '\n')
+        return code
+
+    def append(self, cameraID, timestamp, path, size, imageHash, success):
+        """Record a capture. path may be absolute or relative to the crawler;
+        it is stored relative to the folder of the log."""
+        if self.readOnly:
+            raise ValueError('capture log of {} is open read-only'.format(self.folder))
+        relative = os.path.relpath(path, self.folder).encode() if path else b''
+        with self.lock:
+            self.buffers['camera'].append(self.cameraCode(str(cameraID)))
+            self.buffers['timestamp'].append(timestamp)
+            self.buffers['size'].append(size)
+            self.buffers['hash'].append(int(imageHash, 16) if imageHash else 0)
+            self.buffers['success'].append(1 if success else 0)
+            self.pathBuffer += relative
+            self.buffers['pathEnd'].append(self.pathBytes + len(self.pathBuffer))
+            if (len(self.buffers['camera']) >= self.flushEvery
+                    or time.monotonic() - self.lastFlush >= self.flushSeconds):
+                self.flushLocked()
+
+    def flushLocked(self):
+        self.lastFlush = time.monotonic()
+        if not self.buffers['camera']:
+            return
+        with open(os.path.join(self.path, 'paths.blob'), 'ab') as paths:
+            paths.write(self.pathBuffer)
+        self.pathBytes += len(self.pathBuffer)
+        self.pathBuffer = bytearray()
+        # pathEnd goes last: a crash before it leaves the block to be cut off by repair()
+        for name in sorted(self.columns, key=lambda name: name == 'pathEnd'):
+            with open(self.columnFile(name), 'ab') as column:
+                self.buffers[name].tofile(column)
+            self.buffers[name] = array(self.columns[name])
+        self.loaded = None
+
+    def flush(self):
+        with self.lock:
+            self.flushLocked()
+
+    def load(self):
+        """Read the flushed columns into numpy arrays, once per flush."""
+        with self.lock:
+            if self.loaded is None:
+                loaded = {name: self.readColumn(name, typecode) for name, typecode in self.columns.items()}
+                # Only complete records: a block being flushed right now is cut off
+                records = min(len(column) for column in loaded.values())
+                loaded = {name: column[:records] for name, column in loaded.items()}
+                with open(os.path.join(self.path, 'paths.blob'), 'rb') as paths:
+                    loaded['paths'] = paths.read()
+                self.loaded = loaded
+            return self.loaded
+
+    def readColumn(self, name, typecode):
+        try:
+            with open(self.columnFile(name), 'rb') as column:
+                data = column.read()
+        except FileNotFoundError:
+            data = b''
+        itemSize = array(typecode).itemsize
+        return np.frombuffer(data[:len(data) - len(data) % itemSize], dtype=self.numpyTypes[typecode])
+
+    def query(self, cameraID, start=None, end=None, successfulOnly=True):
+        """Return the paths of a camera's captures between start and end
+        (unix timestamps, inclusive), sorted by capture time."""
+        self.flush()
+        code = self.cameraCodes.get(str(cameraID))
+        if code is None:
+            return []
+        columns = self.load()
+        mask = columns['camera'] == code
+        if start is not None:
+            mask &= columns['timestamp'] >= start
+        if end is not None:
+            mask &= columns['timestamp'] <= end
+        if successfulOnly:
+            mask &= columns['success'] == 1
+        rows = np.nonzero(mask)[0]
+        rows = rows[np.argsort(columns['timestamp'][rows], kind='stable')]
+        pathEnds = columns['pathEnd']
+        paths = []
+        for row in rows:
+            pathStart = int(pathEnds[row - 1]) if row else 0
+            relative = columns['paths'][pathStart:int(pathEnds[row])].decode()
+            if relative:
+                paths.append(os.path.join(self.folder, relative))
+        return paths
+
+    def close(self):
+        self.flush()
@@ -0,0 +1,215 @@
+from collections import OrderedDict
+import math
+import re
+import threading
+import time
+from urllib.parse import urlparse
+
+import cv2
+
+
+class CaptureSession(object):
+    """An open cv2.VideoCapture of one camera, reused between grabs."""
+
+    # Frame rate assumed when the stream does not report a usable one
+    defaultFPS = 25
+    maxDrain = 30
+
+    def __init__(self, url, openCapture):
+        self.url = url
+        self.openCapture = openCapture
+        self.capture = None
+        self.lock = threading.Lock()
+        self.lastUsed = time.monotonic()
+        self.evicted = False
+        self.fps = self.defaultFPS
+        self.frames = 0
+        # Set when the stream ended after a single frame, i.e. the url is a still image
+        self.snapshot = False
+
+    def open(self):
+        self.close()
+        self.capture = self.openCapture(self.url)
+        fps = self.capture.get(cv2.CAP_PROP_FPS)
+        self.fps = fps if 1 <= fps <= 120 else self.defaultFPS
+        self.frames = 0
+        return self.capture.isOpened()
+
+    def latest(self, elapsed):
+        """Read the newest frame, skipping frames buffered since the last grab.
+
+        Buffered frames come out of grab() almost instantly, while a frame at
+        the live edge takes about one frame period to arrive. A grab slower
+        than half a frame period therefore means the buffer is drained. At
+        most the number of frames the camera sent in elapsed seconds are
+        skipped."""
+        if not self.capture.grab():
+            return False, None
+        liveEdge = 0.5 / self.fps
+        for _ in range(min(self.maxDrain, math.ceil(elapsed * self.fps))):
+            started = time.monotonic()
+            if not self.capture.grab():
+                # The stream broke or ended, so there is no frame to retrieve
+                return False, None
+            if time.monotonic() - started > liveEdge:
+                break
+        return self.capture.retrieve()
+
+    def read(self):
+        """Return (success, image), reconnecting once if the open handle went bad."""
+        now = time.monotonic()
+        elapsed = now - self.lastUsed
+        self.lastUsed = now
+        if self.capture is not None and self.capture.isOpened():
+            success, image = self.latest(elapsed)
+            if success:
+                self.frames += 1
+                return success, image
+            self.snapshot = self.frames == 1
+        if not self.open():
+            return False, None
+        success, image = self.capture.read()
+        if success:
+            self.frames += 1
+        return success, image
+
+    def close(self):
+        if self.capture is not None:
+            self.capture.release()
+            self.capture = None
+
+
+class CaptureSessionPool(object):
+    """Keeps capture handles open for cameras that are grabbed often.
+
+    At most maxOpen handles are kept; opening another one closes the least
+    recently used idle session. Sessions unused for idleTimeout seconds are
+    closed on the next lookup.
+
+    An open session holds a connection to its camera host just like a
+    one-shot grab does, so open sessions and running one-shot grabs of a
+    host together stay within perHost. Idle sessions of the host are closed
+    to make room; when that is not possible session() returns None and the
+    caller grabs without one.
+
+    Snapshot urls (single JPEG stills rather than streams) end after one
+    frame, so a session only costs them a failed grab and a reconnect.
+    They are recognised by their path, or learned when a session's stream
+    ends after its first frame, and never get a session.
+    """
+
+    snapshotPattern = re.compile(r'snapshot|oneshot|\.(jpe?g|png|bmp)$|(jpg|jpeg|image)\.cgi$', re.IGNORECASE)
+
+    def __init__(self, openCapture, maxOpen=64, idleTimeout=120, perHost=None):
+        self.openCapture = openCapture
+        self.maxOpen = maxOpen
+        self.idleTimeout = idleTimeout
+        self.perHost = perHost
+        self.sessions = OrderedDict()
+        self.hostSessions = {}
+        self.oneShots = {}
+        self.snapshots = set()
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def host(url):
+        return urlparse(url).netloc or url
+
+    def isSnapshot(self, url):
+        """Whether url serves single stills, which gain nothing from a session."""
+        return url in self.snapshots or bool(self.snapshotPattern.search(urlparse(url).path))
+
+    def remove(self, url, session):
+        """Close an idle session. Returns False if it is being read from."""
+        if not session.lock.acquire(blocking=False):
+            return False
+        try:
+            session.close()
+            session.evicted = True
+        finally:
+            session.lock.release()
+        del self.sessions[url]
+        host = self.host(url)
+        self.hostSessions[host] -= 1
+        if not self.hostSessions[host]:
+            del self.hostSessions[host]
+        return True
+
+    def evict(self, now):
+        """Close idle sessions and, above maxOpen, the least recently used ones.
+
+        Sessions that are being read from are left alone."""
+        for url, session in list(self.sessions.items()):
+            expired = now - session.lastUsed > self.idleTimeout
+            if not expired and len(self.sessions) < self.maxOpen:
+                break
+            self.remove(url, session)
+
+    def makeRoom(self, host):
+        """Close idle sessions of host until one more connection to it fits within perHost."""
+        if self.perHost is None:
+            return True
+        for url, session in list(self.sessions.items()):
+            if self.hostSessions.get(host, 0) + self.oneShots.get(host, 0) < self.perHost:
+                return True
+            if self.host(url) == host:
+                self.remove(url, session)
+        return self.hostSessions.get(host, 0) + self.oneShots.get(host, 0) < self.perHost
+
+    def session(self, url):
+        """Return the session of url, opening a new one if there is room for it, else None."""
+        with self.lock:
+            self.evict(time.monotonic())
+            session = self.sessions.get(url)
+            if session is not None:
+                self.sessions.move_to_end(url)
+                return session
+            host = self.host(url)
+            if not self.makeRoom(host):
+                return None
+            session = CaptureSession(url, self.openCapture)
+            self.sessions[url] = session
+            self.hostSessions[host] = self.hostSessions.get(host, 0) + 1
+            return session
+
+    def read(self, url):
+        """Grab the latest frame of url over its kept-open session.
+
+        Returns None if url has no session and none could be opened."""
+        while True:
+            session = self.session(url)
+            if session is None:
+                return None
+            with session.lock:
+                # Evicted between lookup and lock: fetch the replacement instead
+                if session.evicted:
+                    continue
+                result = session.read()
+            if session.snapshot:
+                with self.lock:
+                    self.snapshots.add(url)
+                    if self.sessions.get(url) is session:
+                        self.remove(url, session)
+            return result
+
+    def startOneShot(self, url):
+        """Account for a one-shot grab of url, closing an idle session of its host if needed."""
+        host = self.host(url)
+        with self.lock:
+            self.makeRoom(host)
+            self.oneShots[host] = self.oneShots.get(host, 0) + 1
+
+    def endOneShot(self, url):
+        host = self.host(url)
+        with self.lock:
+            self.oneShots[host] -= 1
+            if not self.oneShots[host]:
+                del self.oneShots[host]
+
+    def closeAll(self):
+        with self.lock:
+            for session in self.sessions.values():
+                with session.lock:
+                    session.close()
+            self.sessions.clear()
+            self.hostSessions.clear()
@@ -1,17 +1,92 @@
 import multiprocessing
+import threading
+
+
+class CounterSet(object):
+    """A group of named counters sharded over one shared-memory array.
+
+    Every worker thread gets its own row of slots and is the only writer of
+    that row, so increments need no lock. Reading a counter sums its column
+    over all rows. reset() does not touch the rows: it stores the current
+    sums as a baseline in shared memory, so every reader sees the same
+    starting point afterwards.
+    """
+
+    def __init__(self, names, shards=16):
+        self.names = list(names)
+        self.columns = {name: column for column, name in enumerate(self.names)}
+        self.shards = shards
+        self.slots = multiprocessing.RawArray('q', shards * len(self.names))
+        self.baseline = multiprocessing.RawArray('q', len(self.names))
+        # Threads beyond the number of shards share one locked overflow row.
+        self.overflow = multiprocessing.RawArray('q', len(self.names))
+        self.overflowLock = threading.Lock()
+        self.nextShard = 0
+        self.shardLock = threading.Lock()
+        self.local = threading.local()
+
+    def shard(self):
+        shard = getattr(self.local, 'shard', None)
+        if shard is None:
+            # Taken once per thread, never on the increment path afterwards.
+            with self.shardLock:
+                if self.nextShard < self.shards:
+                    shard = self.nextShard
+                    self.nextShard += 1
+                else:
+                    shard = -1
+            self.local.shard = shard
+        return shard
+
+    def increment(self, name, n=1):
+        column = self.columns[name]
+        shard = self.shard()
+        if shard < 0:
+            with self.overflowLock:
+                self.overflow[column] += n
+            return
+        self.slots[shard * len(self.names) + column] += n
+
+    def total(self, column):
+        width = len(self.names)
+        return sum(self.slots[column::width]) + self.overflow[column]
+
+    def value(self, name):
+        column = self.columns[name]
+        return self.total(column) - self.baseline[column]
+
+    def reset(self, *names):
+        """Start the given counters, or all of them, from zero again."""
+        for name in names or self.names:
+            column = self.columns[name]
+            self.baseline[column] = self.total(column)
+
+    def snapshot(self):
+        """Return a dict of every counter's value."""
+        width = len(self.names)
+        slots = self.slots[:]
+        return {name: sum(slots[column::width]) + self.overflow[column] - self.baseline[column]
+                for name, column in self.columns.items()}
+
+    def counter(self, name):
+        return Counter(self, name)
 
 
 class Counter(object):
-    def __init__(self):
-        self.val = multiprocessing.Value('i', 0)
+    """A single counter of a CounterSet."""
+
+    def __init__(self, counterSet=None, name='value'):
+        if counterSet is None:
+            counterSet = CounterSet([name], shards=1)
+        self.counterSet = counterSet
+        self.name = name
 
     def increment(self, n=1):
-        with self.val.get_lock():
-            self.val.value += n
+        self.counterSet.increment(self.name, n)
 
     def reset(self):
-        self.val = multiprocessing.Value('i', 0)
+        self.counterSet.reset(self.name)
 
     @property
     def value(self):
-        return self.val.value
+        return self.counterSet.value(self.name)
@@ -0,0 +1,20 @@
+class CountryJob(object):
+    """Crawl state of a single country.
+
+    Everything a country crawl needs is kept here instead of on the
+    Insecrawl instance, so several countries can be crawled at once.
+    """
+
+    def __init__(self, country, countryName, downloadFolder, totalCams):
+        self.country = country
+        self.countryName = countryName
+        self.downloadFolder = downloadFolder
+        # Cameras the progress bar counts towards. In --scrapeAllCameras mode
+        # this is the total over every country.
+        self.totalCams = totalCams
+        self.maxPages = 0
+        # With --newCamsOnly: cameras that had a still on disk before the crawl started
+        self.skipCameras = set()
+
+    def pageURL(self, insecamURL, page):
+        return '{}/en/bycountry/{}/?page={}'.format(insecamURL, self.country, page)
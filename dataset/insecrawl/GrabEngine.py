@@ -0,0 +1,136 @@
+import threading
+import time
+from urllib.parse import urlparse
+
+import cv2
+
+from CaptureSessions import CaptureSessionPool
+
+
+class HostHealth(object):
+    """Per-host circuit breaker for camera grabs.
+
+    After failureThreshold consecutive failures a host is skipped for a
+    backoff period. When the period runs out a single probe grab is let
+    through; if it fails too, the backoff doubles up to maxBackoff. Any
+    success closes the circuit again. The state lives as long as the
+    Insecrawl instance, so it carries over between --interval cycles.
+    """
+
+    def __init__(self, failureThreshold=3, baseBackoff=60, maxBackoff=3600):
+        self.failureThreshold = failureThreshold
+        self.baseBackoff = baseBackoff
+        self.maxBackoff = maxBackoff
+        self.hosts = {}
+        self.lock = threading.Lock()
+
+    def state(self, host):
+        entry = self.hosts.get(host)
+        if entry is None:
+            entry = {'failures': 0, 'backoff': 0, 'openUntil': 0, 'probing': False}
+            self.hosts[host] = entry
+        return entry
+
+    def allow(self, host):
+        """Return True if a grab from host should be attempted now."""
+        with self.lock:
+            entry = self.state(host)
+            if entry['failures'] < self.failureThreshold:
+                return True
+            if entry['probing'] or time.monotonic() < entry['openUntil']:
+                return False
+            entry['probing'] = True
+            return True
+
+    def recordSuccess(self, host):
+        with self.lock:
+            entry = self.state(host)
+            entry['failures'] = 0
+            entry['backoff'] = 0
+            entry['probing'] = False
+
+    def recordFailure(self, host):
+        with self.lock:
+            entry = self.state(host)
+            entry['failures'] += 1
+            entry['probing'] = False
+            if entry['failures'] >= self.failureThreshold:
+                if entry['backoff']:
+                    entry['backoff'] = min(entry['backoff'] * 2, self.maxBackoff)
+                else:
+                    entry['backoff'] = self.baseBackoff
+                entry['openUntil'] = time.monotonic() + entry['backoff']
+
+    def openHosts(self):
+        """Return the hosts that are currently being skipped."""
+        now = time.monotonic()
+        with self.lock:
+            return [host for host, entry in self.hosts.items()
+                    if entry['failures'] >= self.failureThreshold and now < entry['openUntil']]
+
+
+class GrabEngine(object):
+    """Grabs single frames from camera streams with bounded connect and read times."""
+
+    OK = 'ok'
+    FAILED = 'failed'
+    SKIPPED = 'skipped'
+
+    def __init__(self, connectTimeout=10, readTimeout=10, health=None, maxSessions=64, sessionIdle=120,
+                 perHost=None):
+        self.connectTimeout = connectTimeout
+        self.readTimeout = readTimeout
+        self.health = health or HostHealth()
+        self.sessions = CaptureSessionPool(self.openCapture, maxSessions, sessionIdle, perHost)
+
+    def openCapture(self, url):
+        # Timeout properties were added in OpenCV 4.5.2. Older builds fall
+        # back to ffmpeg's own (much longer) defaults.
+        openTimeout = getattr(cv2, 'CAP_PROP_OPEN_TIMEOUT_MSEC', None)
+        readTimeout = getattr(cv2, 'CAP_PROP_READ_TIMEOUT_MSEC', None)
+        if openTimeout is None or readTimeout is None:
+            return cv2.VideoCapture(url)
+        params = [openTimeout, int(self.connectTimeout * 1000),
+                  readTimeout, int(self.readTimeout * 1000)]
+        return cv2.VideoCapture(url, cv2.CAP_FFMPEG, params)
+
+    def grab(self, url, keepOpen=False):
+        """Grab one frame from url. Returns a (status, image) tuple.
+
+        With keepOpen the capture stays open for the next grab of url and
+        the newest frame is read from it, instead of connecting again.
+        Snapshot urls, and hosts without room for another open session, are
+        grabbed with a fresh connection either way."""
+        host = urlparse(url).netloc or url
+        if not self.health.allow(host):
+            return self.SKIPPED, None
+        success = False
+        try:
+            result = None
+            if keepOpen and not self.sessions.isSnapshot(url):
+                result = self.sessions.read(url)
+            if result is None:
+                result = self.grabOnce(url)
+            success, image = result
+        finally:
+            # Recorded even if the grab raised, which also ends a probe of
+            # the host instead of leaving it skipped for good.
+            if success:
+                self.health.recordSuccess(host)
+            else:
+                self.health.recordFailure(host)
+        if success:
+            return self.OK, image
+        return self.FAILED, None
+
+    def grabOnce(self, url):
+        self.sessions.startOneShot(url)
+        vidObj = self.openCapture(url)
+        try:
+            return vidObj.read()
+        finally:
+            vidObj.release()
+            self.sessions.endOneShot(url)
+
+    def close(self):
+        self.sessions.closeAll()
@@ -0,0 +1,101 @@
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+import threading
+from urllib.parse import urlparse
+
+
+class GrabPool(object):
+    """Persistent, bounded thread pool for camera grabs.
+
+    cv2.VideoCapture grabs spend nearly all of their time waiting on the
+    network, so threads are enough. Each camera host additionally gets at
+    most perHostLimit grabs running at once, so that a single server with
+    many cameras is not hammered by every worker at once. Grabs over that
+    limit wait in a per-host queue outside the pool and are handed to it as
+    the host's running grabs finish, so they never tie up a worker that
+    could be grabbing from another host.
+    """
+
+    def __init__(self, maxWorkers=12, perHostLimit=2):
+        self.maxWorkers = maxWorkers
+        self.perHostLimit = perHostLimit
+        self.executor = ThreadPoolExecutor(max_workers=maxWorkers,
+                                           thread_name_prefix='grab')
+        self.running = {}
+        self.pending = {}
+        self.outstanding = 0
+        self.closed = False
+        self.cancelled = False
+        self.condition = threading.Condition()
+
+    def submit(self, url, fn, *args):
+        """Queue fn(*args) to run once a connection slot for url's host is free.
+
+        Returns a Future of the result."""
+        host = urlparse(url).netloc or url
+        job = (Future(), fn, args)
+        with self.condition:
+            if self.closed:
+                raise RuntimeError('cannot submit grabs after shutdown')
+            self.outstanding += 1
+            if self.running.get(host, 0) >= self.perHostLimit:
+                self.pending.setdefault(host, deque()).append(job)
+                return job[0]
+            self.running[host] = self.running.get(host, 0) + 1
+        self.executor.submit(self.run, host, *job)
+        return job[0]
+
+    def run(self, host, future, fn, args):
+        try:
+            if self.cancelled:
+                future.cancel()
+            if future.set_running_or_notify_cancel():
+                try:
+                    future.set_result(fn(*args))
+                except BaseException as err:
+                    future.set_exception(err)
+        finally:
+            self.release(host)
+
+    def release(self, host):
+        """Hand the host's slot to its next queued grab, or free it."""
+        with self.condition:
+            self.outstanding -= 1
+            queued = self.pending.get(host)
+            job = queued.popleft() if queued else None
+            if queued is not None and not queued:
+                del self.pending[host]
+            if job is None:
+                self.running[host] -= 1
+                if not self.running[host]:
+                    del self.running[host]
+            self.condition.notify_all()
+        if job is not None:
+            self.executor.submit(self.run, host, *job)
+
+    def wait(self, futures):
+        """Block until every future in futures has finished."""
+        if futures:
+            wait(futures)
+
+    def cancelPending(self):
+        """Cancel every grab that has not started yet, including ones
+        submitted later. Running grabs are left to finish."""
+        with self.condition:
+            self.cancelled = True
+            for queued in self.pending.values():
+                for future, _, _ in queued:
+                    future.cancel()
+
+    def shutdown(self, cancelPending=False):
+        """Wait for every queued grab to finish, then stop the workers.
+
+        With cancelPending, grabs that have not started are cancelled
+        instead and only the running ones are waited for."""
+        if cancelPending:
+            self.cancelPending()
+        with self.condition:
+            self.closed = True
+            while self.outstanding:
+                self.condition.wait()
+        self.executor.shutdown(wait=True)
@@ -0,0 +1,136 @@
+import copy
+import hashlib
+import json
+import os
+import threading
+import time
+import urllib.error
+from urllib.request import Request, urlopen
+
+
+class HttpCache(object):
+    """On-disk cache for insecam metadata requests.
+
+    Responses are kept fresh for a per-request TTL. Once stale they are
+    revalidated with If-None-Match / If-Modified-Since, so an unchanged page
+    costs a 304 instead of a full download. Parsed results are memoized
+    against the cached response, so an unchanged page is not parsed again
+    either. In offline mode only the cache is used, which lets crawls and
+    tests run without network access.
+    """
+
+    def __init__(self, folder='.insecrawl_cache', offline=False):
+        self.folder = folder
+        self.offline = offline
+        self.parsed = {}
+        self.lock = threading.Lock()
+        os.makedirs(folder, exist_ok=True)
+
+    def paths(self, url):
+        key = hashlib.sha1(url.encode()).hexdigest()
+        base = os.path.join(self.folder, key)
+        return base + '.json', base + '.body'
+
+    def load(self, url):
+        metaPath, bodyPath = self.paths(url)
+        try:
+            with open(metaPath) as metaFile:
+                meta = json.load(metaFile)
+            with open(bodyPath, 'rb') as bodyFile:
+                return meta, bodyFile.read()
+        except (OSError, ValueError):
+            return None, None
+
+    def store(self, url, meta, body=None):
+        metaPath, bodyPath = self.paths(url)
+        if body is not None:
+            with open(bodyPath + '.tmp', 'wb') as bodyFile:
+                bodyFile.write(body)
+            os.replace(bodyPath + '.tmp', bodyPath)
+        with open(metaPath + '.tmp', 'w') as metaFile:
+            json.dump(meta, metaFile)
+        os.replace(metaPath + '.tmp', metaPath)
+
+    def cached(self, url, ttl):
+        """Return (meta, body) of url if the cache may serve it without asking
+        the server, (meta, None) if a stale copy needs revalidating and
+        (None, None) if url is not cached.
+
+        In offline mode an uncached url raises URLError."""
+        meta, body = self.load(url)
+        if meta is not None and (self.offline or time.time() - meta['fetched'] < ttl):
+            return meta, body
+        if self.offline:
+            raise urllib.error.URLError('{} is not cached and offline mode is on'.format(url))
+        return meta, None
+
+    @staticmethod
+    def validators(meta):
+        """Return the conditional request headers for a cached response."""
+        headers = {}
+        if meta is not None:
+            if meta.get('etag'):
+                headers['If-None-Match'] = meta['etag']
+            if meta.get('lastModified'):
+                headers['If-Modified-Since'] = meta['lastModified']
+        return headers
+
+    def storeResponse(self, url, etag, lastModified, body):
+        """Cache a full response. Returns its meta."""
+        now = time.time()
+        meta = {'url': url, 'fetched': now, 'etag': etag, 'lastModified': lastModified, 'version': now}
+        self.store(url, meta, body)
+        return meta
+
+    def storeNotModified(self, url, meta):
+        """Mark a cached response as fresh again after a 304. Returns its body."""
+        meta['fetched'] = time.time()
+        self.store(url, meta)
+        return self.load(url)[1]
+
+    def fetch(self, url, headers, ttl):
+        """Return (meta, body) for url, from the cache when possible.
+
+        HTTP errors other than 304 are raised like urlopen does, so callers
+        keep their existing error handling."""
+        meta, body = self.cached(url, ttl)
+        if body is not None:
+            return meta, body
+
+        headers = dict(headers)
+        headers.update(self.validators(meta))
+        try:
+            response = urlopen(Request(url=url, headers=headers))
+            body = response.read()
+            meta = self.storeResponse(url, response.headers.get('ETag'),
+                                      response.headers.get('Last-Modified'), body)
+        except urllib.error.HTTPError as err:
+            if err.code != 304 or meta is None:
+                raise
+            body = self.storeNotModified(url, meta)
+        except urllib.error.URLError:
+            # Serve a stale copy rather than nothing when the site is unreachable.
+            if meta is None:
+                raise
+            body = self.load(url)[1]
+        return meta, body
+
+    def get(self, url, headers, ttl):
+        """Return the body of url."""
+        return self.fetch(url, headers, ttl)[1]
+
+    def getParsed(self, url, headers, ttl, parse):
+        """Return parse(body) for url, parsing only when the response changed.
+
+        Every call returns its own copy of the parsed result."""
+        meta, body = self.fetch(url, headers, ttl)
+        key = (url, parse)
+        with self.lock:
+            cached = self.parsed.get(key)
+            if cached is not None and cached[0] == meta['version']:
+                # Callers are free to modify what they get back
+                return copy.deepcopy(cached[1])
+        result = parse(body)
+        with self.lock:
+            self.parsed[key] = (meta['version'], result)
+        return copy.deepcopy(result)
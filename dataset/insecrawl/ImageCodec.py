@@ -0,0 +1,97 @@
+"""JPEG encoding of grabbed frames at quality and resolution tiers.
+
+A faster JPEG library is used when one is installed (simplejpeg, then
+PyTurboJPEG); otherwise OpenCV does the work.
+"""
+
+import os
+
+import cv2
+import numpy as np
+
+# Longest side in pixels (None keeps the full resolution) and JPEG quality of each tier
+TIERS = {
+    'thumbnail': {'maxSide': 320, 'quality': 70},
+    'analysis': {'maxSide': 1280, 'quality': 85},
+    # OpenCV's own default, which cv2.imwrite saved archives at before the tiers
+    'archive': {'maxSide': None, 'quality': 95},
+}
+
+try:
+    import simplejpeg
+
+    BACKEND = 'simplejpeg'
+except ImportError:
+    try:
+        from turbojpeg import TurboJPEG
+
+        turbo = TurboJPEG()
+        BACKEND = 'turbojpeg'
+    except (ImportError, RuntimeError):
+        # RuntimeError: PyTurboJPEG is installed but libturbojpeg is not
+        BACKEND = 'opencv'
+
+
+def encode(image, quality=95):
+    """Encode a BGR (or grayscale) frame as JPEG bytes."""
+    if BACKEND == 'simplejpeg' and image.ndim == 3:
+        return simplejpeg.encode_jpeg(np.ascontiguousarray(image), quality=quality, colorspace='BGR')
+    if BACKEND == 'turbojpeg' and image.ndim == 3:
+        return turbo.encode(image, quality=quality)
+    success, buffer = cv2.imencode('.jpg', image, [cv2.IMWRITE_JPEG_QUALITY, quality])
+    if not success:
+        raise ValueError('Could not encode image')
+    return buffer.tobytes()
+
+
+def downscale(image, maxSide):
+    """Shrink a frame so its longest side is at most maxSide, keeping the aspect ratio.
+
+    Frames that are small enough already are returned as they are."""
+    height, width = image.shape[:2]
+    if maxSide is None or max(height, width) <= maxSide:
+        return image
+    scale = maxSide / max(height, width)
+    size = (max(1, round(width * scale)), max(1, round(height * scale)))
+    return cv2.resize(image, size, interpolation=cv2.INTER_AREA)
+
+
+def encodeTiers(image, tiers=('archive',), quality=None):
+    """Encode one frame at several tiers. Returns a {tier: JPEG bytes} dict.
+
+    Tiers are produced from the largest down, each one resized from the
+    previous tier rather than from the full frame. quality maps tiers to a
+    JPEG quality overriding the TIERS default."""
+    quality = quality or {}
+    ordered = sorted(tiers, key=lambda tier: -(TIERS[tier]['maxSide'] or float('inf')))
+    encoded = {}
+    for tier in ordered:
+        image = downscale(image, TIERS[tier]['maxSide'])
+        encoded[tier] = encode(image, quality.get(tier, TIERS[tier]['quality']))
+    return encoded
+
+
+def tierPath(path, tier):
+    """Return where a tier of the image at path is stored.
+
+    The archive tier is the path itself; other tiers go to a hidden folder
+    named after the tier next to it, e.g. images/.thumbnail/[1234]_.jpg."""
+    if tier == 'archive':
+        return path
+    folder, name = os.path.split(path)
+    return os.path.join(folder, '.' + tier, name)
+
+
+def writeTiers(image, path, tiers=('archive',), quality=None):
+    """Encode one frame at several tiers and write each to its tierPath.
+
+    Returns a {tier: bytes written} dict."""
+    sizes = {}
+    for tier, data in encodeTiers(image, tiers, quality).items():
+        target = tierPath(path, tier)
+        if tier != 'archive':
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+        with open(target, 'wb') as f:
+            f.write(data)
+        sizes[tier] = len(data)
+    return sizes
@@ -0,0 +1,136 @@
+from concurrent.futures import ThreadPoolExecutor
+import hashlib
+import threading
+
+import cv2
+import numpy as np
+
+import ImageCodec
+
+
+def perceptualHash(image):
+    """64 bit difference hash (dHash) of a BGR frame, as a hex string."""
+    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY) if image.ndim == 3 else image
+    small = cv2.resize(gray, (9, 8), interpolation=cv2.INTER_AREA)
+    bits = small[:, 1:] > small[:, :-1]
+    return np.packbits(bits).tobytes().hex()
+
+
+def contentHash(image):
+    """64 bit BLAKE2 digest of a frame's pixels, as a hex string. Only identical frames match."""
+    digest = hashlib.blake2b(np.ascontiguousarray(image).data, digest_size=8)
+    digest.update(repr(image.shape).encode())
+    return digest.hexdigest()
+
+
+def hashDistance(a, b):
+    """Number of differing bits between two hashes from perceptualHash."""
+    return bin(int(a, 16) ^ int(b, 16)).count('1')
+
+
+class ImageStore(object):
+    """Writes grabbed frames, skipping ones that repeat the camera's last frame.
+
+    Frozen or offline cameras keep returning the same still. When a frame is
+    pixel for pixel the previous stored frame of that camera, only a
+    reference to the existing file is recorded in the camera index.
+
+    With maxDistance, frames whose perceptual hash (a 64 bit dHash of the
+    whole frame) is within maxDistance bits of the previous one count as
+    duplicates too. That also catches cameras whose still is re-encoded
+    with noise, but a person taking up a few percent of the frame barely
+    moves the hash, so their frames can be dropped as well. It is opt-in
+    for that reason.
+
+    With asyncWrites the JPEG encode and write happen on a background writer
+    thread, and at most maxPendingWrites frames wait for it before save()
+    starts blocking.
+
+    Every stored frame is encoded once per tier in tiers (see ImageCodec).
+    The archive tier goes to the image path, at quality if given.
+
+    A capture is recorded in the camera index, and appended to the
+    CaptureLog passed to save(), only once its file is on disk, so neither
+    ever points at a file that is still being written or failed to write.
+    References to an earlier file are logged with a size of 0.
+
+    compare() does the duplicate check without storing anything, for crawls
+    that do not save frames.
+    """
+
+    def __init__(self, dedupe=True, asyncWrites=False, maxPendingWrites=64, tiers=('archive',), quality=None,
+                 maxDistance=None):
+        self.dedupe = dedupe
+        self.maxDistance = maxDistance
+        self.tiers = tiers
+        self.quality = {'archive': quality} if quality else None
+        self.lastHashes = {}
+        self.lock = threading.Lock()
+        self.writer = None
+        if asyncWrites:
+            self.writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix='writer')
+            self.pendingWrites = threading.BoundedSemaphore(maxPendingWrites)
+
+    def store(self, imagePath, image, onWritten=None):
+        try:
+            size = ImageCodec.writeTiers(image, imagePath, self.tiers, self.quality)['archive']
+        except (OSError, ValueError):
+            size = 0
+        if onWritten is not None:
+            onWritten(size, size > 0)
+
+    def write(self, imagePath, image, onWritten=None):
+        """Write image to imagePath, then call onWritten(size, success)."""
+        if self.writer is None:
+            self.store(imagePath, image, onWritten)
+            return
+        self.pendingWrites.acquire()
+        future = self.writer.submit(self.store, imagePath, image, onWritten)
+        future.add_done_callback(lambda _: self.pendingWrites.release())
+
+    def frameHash(self, image):
+        return contentHash(image) if self.maxDistance is None else perceptualHash(image)
+
+    def matches(self, imageHash, previousHash):
+        """Whether a frame with imageHash repeats the frame previousHash was taken of."""
+        if previousHash is None:
+            return False
+        if self.maxDistance is None:
+            return imageHash == previousHash
+        return hashDistance(imageHash, previousHash) <= self.maxDistance
+
+    def save(self, index, cameraID, image, imagePath, captured, log=None):
+        """Store image for cameraID. Returns the path the capture is stored at
+        and whether it was a duplicate."""
+        imageHash = self.frameHash(image)
+        previous = index.get(cameraID)
+        if self.dedupe and previous is not None:
+            if self.matches(imageHash, previous[2]):
+                index.recordReference(cameraID, captured)
+                if log is not None:
+                    log.append(cameraID, captured, previous[1], 0, imageHash, True)
+                return previous[1], True
+
+        def onWritten(size, success):
+            if success:
+                index.record(cameraID, captured, imagePath, imageHash)
+            if log is not None:
+                log.append(cameraID, captured, imagePath, size, imageHash, success)
+
+        self.write(imagePath, image, onWritten)
+        return imagePath, False
+
+    def compare(self, cameraID, image):
+        """Whether image repeats the last frame of cameraID that was not a
+        duplicate itself. Nothing is written; the hashes are kept in memory."""
+        imageHash = self.frameHash(image)
+        with self.lock:
+            duplicate = self.matches(imageHash, self.lastHashes.get(cameraID))
+            if not duplicate:
+                self.lastHashes[cameraID] = imageHash
+        return duplicate
+
+    def close(self):
+        """Wait for queued writes to finish."""
+        if self.writer is not None:
+            self.writer.shutdown(wait=True)
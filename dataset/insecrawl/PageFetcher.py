@@ -0,0 +1,221 @@
+import asyncio
+from html.parser import HTMLParser
+import http.client
+import re
+import ssl
+from urllib.parse import urlparse
+
+
+class CameraImageParser(HTMLParser):
+    """Collects the camera <img id="imageN"> tags of a listing page.
+
+    Only start tags are looked at, no tree is built, so this is much cheaper
+    than a full BeautifulSoup parse of the page.
+    """
+
+    idPattern = re.compile(r'image(\d+)')
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.cameras = []
+
+    def handle_starttag(self, tag, attrs):
+        if tag != 'img':
+            return
+        attrs = dict(attrs)
+        src = attrs.get('src')
+        imageID = attrs.get('id')
+        if not src or not imageID:
+            return
+        if "yandex" in src or attrs.get('title') == "LiveInternet":
+            return
+        match = self.idPattern.search(imageID)
+        if match:
+            self.cameras.append((match.group(1), src))
+
+    @classmethod
+    def extract(cls, html):
+        """Return a list of (cameraID, imageURL) tuples found in html."""
+        if isinstance(html, bytes):
+            html = html.decode('utf-8', errors='replace')
+        parser = cls()
+        parser.feed(html)
+        parser.close()
+        return parser.cameras
+
+
+class PageFetcher(object):
+    """Concurrency limited asyncio page fetcher with keep-alive connections.
+
+    Pages are fetched over asyncio streams, so every socket is driven by one
+    event loop and no threads are involved. HTTP/1.1 requests go over a pool
+    of idle keep-alive connections per host: consecutive pages reuse the
+    same TCP connection instead of reconnecting for each one.
+
+    Given an HttpCache, pages go through it like every other insecam
+    request: fresh entries and offline mode are served from the cache, and
+    stale entries are revalidated with If-None-Match / If-Modified-Since.
+
+    Once the optional stop Event is set, pages that have not been requested
+    yet are skipped.
+    """
+
+    def __init__(self, concurrency=8, timeout=20, headers=None, cache=None, ttl=0, stop=None):
+        self.concurrency = concurrency
+        self.timeout = timeout
+        self.headers = headers or {}
+        self.cache = cache
+        self.ttl = ttl
+        self.stop = stop
+        self.idle = {}
+
+    async def connect(self, scheme, host, port):
+        sslContext = ssl.create_default_context() if scheme == 'https' else None
+        return await asyncio.open_connection(host, port, ssl=sslContext)
+
+    async def exchange(self, reader, writer, netloc, path, extraHeaders):
+        """Send one GET over an open connection. Returns (status, headers, body, keepAlive)."""
+        headers = dict(self.headers)
+        headers.update(extraHeaders)
+        headers.update({'Host': netloc, 'Connection': 'keep-alive', 'Accept-Encoding': 'identity'})
+        request = 'GET {} HTTP/1.1\r\n'.format(path) + ''.join(
+            '{}: {}\r\n'.format(name, value) for name, value in headers.items()) + '\r\n'
+        writer.write(request.encode('latin-1'))
+        await writer.drain()
+
+        statusLine = await reader.readline()
+        if not statusLine:
+            raise http.client.RemoteDisconnected('Remote end closed connection without response')
+        parts = statusLine.decode('latin-1').split(None, 2)
+        if len(parts) < 2 or not parts[0].startswith('HTTP/') or not parts[1].isdigit():
+            raise http.client.BadStatusLine(statusLine)
+        version, status = parts[0], int(parts[1])
+        response = {}
+        while True:
+            line = await reader.readline()
+            if line in (b'\r\n', b'\n', b''):
+                break
+            name, _, value = line.decode('latin-1').partition(':')
+            response[name.strip().lower()] = value.strip()
+
+        connection = response.get('connection', '').lower()
+        keepAlive = connection == 'keep-alive' if version == 'HTTP/1.0' else connection != 'close'
+        if status in (204, 304) or 100 <= status < 200:
+            body = b''
+        elif 'chunked' in response.get('transfer-encoding', '').lower():
+            body = await self.readChunked(reader)
+        elif 'content-length' in response:
+            body = await reader.readexactly(int(response['content-length']))
+        else:
+            # No framing: the body runs until the server closes the connection
+            body = await reader.read()
+            keepAlive = False
+        return status, response, body, keepAlive
+
+    @staticmethod
+    async def readChunked(reader):
+        chunks = []
+        while True:
+            size = int((await reader.readline()).split(b';')[0].strip(), 16)
+            if size == 0:
+                # Skip the trailer section
+                while (await reader.readline()) not in (b'\r\n', b'\n', b''):
+                    pass
+                return b''.join(chunks)
+            chunks.append(await reader.readexactly(size))
+            await reader.readexactly(2)
+
+    async def request(self, url, extraHeaders):
+        """GET url over a pooled keep-alive connection. Returns (status, headers, body)."""
+        parsed = urlparse(url)
+        path = parsed.path or '/'
+        if parsed.query:
+            path = '{}?{}'.format(path, parsed.query)
+        port = parsed.port or (443 if parsed.scheme == 'https' else 80)
+        key = (parsed.scheme, parsed.hostname, port)
+        idle = self.idle.setdefault(key, [])
+        if idle:
+            reader, writer = idle.pop()
+            try:
+                status, headers, body, keepAlive = await asyncio.wait_for(
+                    self.exchange(reader, writer, parsed.netloc, path, extraHeaders), self.timeout)
+            except (http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError):
+                # The server closed the idle connection in the meantime, so
+                # the request never reached it: send it on a new connection.
+                writer.close()
+            except BaseException:
+                writer.close()
+                raise
+            else:
+                self.release(key, reader, writer, keepAlive)
+                return status, headers, body
+
+        async def fresh():
+            reader, writer = await self.connect(parsed.scheme, parsed.hostname, port)
+            try:
+                status, headers, body, keepAlive = await self.exchange(
+                    reader, writer, parsed.netloc, path, extraHeaders)
+            except BaseException:
+                writer.close()
+                raise
+            self.release(key, reader, writer, keepAlive)
+            return status, headers, body
+
+        return await asyncio.wait_for(fresh(), self.timeout)
+
+    async def fetch(self, url):
+        """Fetch url, through the cache if there is one. Returns (status, body)."""
+        if self.cache is None:
+            status, _, body = await self.request(url, {})
+            return status, body
+        meta, body = self.cache.cached(url, self.ttl)
+        if body is not None:
+            return 200, body
+        status, headers, body = await self.request(url, self.cache.validators(meta))
+        if status == 304 and meta is not None:
+            return 200, self.cache.storeNotModified(url, meta)
+        if status == 200:
+            self.cache.storeResponse(url, headers.get('etag'), headers.get('last-modified'), body)
+        return status, body
+
+    def release(self, key, reader, writer, keepAlive):
+        if keepAlive:
+            self.idle.setdefault(key, []).append((reader, writer))
+        else:
+            writer.close()
+
+    async def fetchAll(self, urls, onPage):
+        """Fetch all urls, at most self.concurrency at a time.
+
+        onPage(url, status, body) is called from the event loop as each page
+        arrives, in completion order. Failed fetches are reported with a
+        status of None and the exception as body.
+        """
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def fetchOne(url):
+            async with semaphore:
+                if self.stop is not None and self.stop.is_set():
+                    return
+                try:
+                    status, body = await self.fetch(url)
+                except (http.client.HTTPException, OSError, asyncio.TimeoutError,
+                        asyncio.IncompleteReadError, ValueError) as err:
+                    status, body = None, err
+            onPage(url, status, body)
+
+        try:
+            await asyncio.gather(*(fetchOne(url) for url in urls))
+        finally:
+            # Connections belong to this run's event loop
+            self.close()
+
+    def run(self, urls, onPage):
+        """Synchronous entry point for fetchAll."""
+        asyncio.run(self.fetchAll(urls, onPage))
+
+    def close(self):
+        for connections in self.idle.values():
+            for _, writer in connections:
+                writer.close()
+        self.idle = {}
@@ -0,0 +1,56 @@
+import threading
+
+
+class ProgressReporter(object):
+    """Renders crawl progress from one background thread at a fixed rate.
+
+    Workers only bump the shared progress counter. This thread reads it
+    refreshRate times per second and redraws only when the value changed, so
+    terminal output no longer scales with the number of grabs.
+    """
+
+    def __init__(self, counterSet, render, name='progress', refreshRate=4):
+        self.counterSet = counterSet
+        self.render = render
+        self.name = name
+        self.interval = 1.0 / refreshRate
+        self.total = 0
+        self.start = 0
+        self.shown = None
+        self.thread = None
+        self.stopped = threading.Event()
+
+    def current(self):
+        return self.counterSet.value(self.name) - self.start
+
+    def draw(self):
+        current = self.current()
+        if self.total and current != self.shown:
+            self.shown = current
+            self.render(current, self.total)
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            self.draw()
+
+    def begin(self, total):
+        """Start reporting progress towards total from the current counter value."""
+        self.end()
+        self.total = total
+        self.start = self.counterSet.value(self.name)
+        self.shown = None
+        self.stopped.clear()
+        self.thread = threading.Thread(target=self.run, name='progress', daemon=True)
+        self.thread.start()
+
+    def end(self):
+        """Stop the reporting thread after drawing the final state."""
+        if self.thread is None:
+            return
+        self.stopped.set()
+        self.thread.join()
+        self.thread = None
+        self.draw()
+        if self.shown is not None and self.shown != self.total:
+            # The bar only ends its line by itself when it reaches 100%
+            print()
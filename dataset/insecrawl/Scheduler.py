@@ -0,0 +1,114 @@
+import heapq
+import itertools
+import random
+import threading
+import time
+
+
+class CrawlScheduler(object):
+    """Priority queue of per-camera due times for continuous crawls.
+
+    Each camera has its own interval, adapted after every grab: cameras
+    whose frame changed are grabbed more often, static ones and failing ones
+    back off. Priority cameras (e.g. the ones watching bike racks) run on
+    priorityFactor times the base interval and never back off beyond it.
+    New cameras are spread evenly over one base interval and every
+    reschedule gets a little jitter, so grabs arrive smoothly instead of in
+    bursts. next() additionally spaces grabs at least 1 / maxRate seconds
+    apart.
+
+    A camera is either queued once or being grabbed, never both, so a
+    camera that drops off the listing and comes back does not end up with
+    several due times.
+    """
+
+    CHANGED = 'changed'
+    UNCHANGED = 'unchanged'
+    FAILED = 'failed'
+    SKIPPED = 'skipped'
+
+    factors = {CHANGED: 0.75, UNCHANGED: 1.5, FAILED: 2.0, SKIPPED: 2.0}
+    jitter = 0.1
+    priorityFactor = 0.5
+
+    def __init__(self, baseInterval, minInterval=None, maxInterval=None, maxRate=0, priority=()):
+        self.baseInterval = baseInterval
+        self.minInterval = minInterval or max(1, baseInterval / 4)
+        self.maxInterval = maxInterval or baseInterval * 8
+        self.maxRate = maxRate
+        self.priority = set(priority)
+        self.queue = []
+        self.cameras = {}
+        self.intervals = {}
+        self.queued = set()
+        self.inFlight = set()
+        self.sequence = itertools.count()
+        self.nextSlot = 0
+        self.condition = threading.Condition()
+
+    def update(self, cameras):
+        """Set the crawled cameras from a {cameraID: imageURL} dict."""
+        with self.condition:
+            new = [cameraID for cameraID in cameras if cameraID not in self.cameras]
+            self.cameras = dict(cameras)
+            now = time.monotonic()
+            for i, cameraID in enumerate(new):
+                self.intervals.setdefault(cameraID, self.upperInterval(cameraID))
+                # Still queued from before it dropped off, or being grabbed right now
+                if cameraID in self.queued or cameraID in self.inFlight:
+                    continue
+                due = now + self.baseInterval * i / len(new)
+                heapq.heappush(self.queue, (due, next(self.sequence), cameraID))
+                self.queued.add(cameraID)
+            self.condition.notify_all()
+
+    def upperInterval(self, cameraID):
+        """Longest interval of cameraID, which is also where it starts."""
+        if cameraID in self.priority:
+            return max(self.minInterval, self.baseInterval * self.priorityFactor)
+        return self.baseInterval
+
+    def next(self, timeout=None):
+        """Wait for the next due camera and return (cameraID, imageURL).
+
+        Returns None if nothing became due within timeout seconds."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self.condition:
+            while True:
+                now = time.monotonic()
+                # Cameras that dropped off the listing are discarded lazily.
+                while self.queue and self.queue[0][2] not in self.cameras:
+                    self.queued.discard(heapq.heappop(self.queue)[2])
+                if self.queue:
+                    ready = max(self.queue[0][0], self.nextSlot)
+                else:
+                    ready = float('inf')
+                if ready <= now:
+                    _, _, cameraID = heapq.heappop(self.queue)
+                    self.queued.discard(cameraID)
+                    self.inFlight.add(cameraID)
+                    if self.maxRate:
+                        self.nextSlot = max(now, self.nextSlot) + 1.0 / self.maxRate
+                    return cameraID, self.cameras[cameraID]
+                if deadline is not None and deadline <= now:
+                    return None
+                waitUntil = ready if deadline is None else min(ready, deadline)
+                self.condition.wait(None if waitUntil == float('inf') else waitUntil - now)
+
+    def done(self, cameraID, outcome):
+        """Reschedule cameraID after a grab with the given outcome."""
+        with self.condition:
+            self.inFlight.discard(cameraID)
+            if cameraID not in self.cameras:
+                return
+            upper = self.upperInterval(cameraID) if cameraID in self.priority else self.maxInterval
+            interval = self.intervals.get(cameraID, self.baseInterval) * self.factors[outcome]
+            interval = min(max(interval, self.minInterval), upper)
+            self.intervals[cameraID] = interval
+            due = time.monotonic() + interval * random.uniform(1 - self.jitter, 1 + self.jitter)
+            heapq.heappush(self.queue, (due, next(self.sequence), cameraID))
+            self.queued.add(cameraID)
+            self.condition.notify_all()
+
+    def __len__(self):
+        return len(self.cameras)
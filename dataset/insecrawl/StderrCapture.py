@@ -0,0 +1,182 @@
+from contextlib import contextmanager
+import itertools
+import os
+import re
+import sys
+import threading
+
+
+class StderrCapture(object):
+    """Redirects the stderr file descriptor into a pipe drained by a reader thread.
+
+    ffmpeg (via cv2) writes its errors straight to fd 2. Instead of spooling
+    them into a temp file for the whole crawl, every line is parsed as it
+    arrives and counted per camera host and message, e.g.
+    ('93.1.2.3:8080', 'tcp: Connection refused'). Only the counts and one
+    sample line per key are kept, and at most maxKeys keys, so memory stays
+    bounded however long the crawl runs.
+
+    Most OpenCV and ffmpeg warnings carry no URL. Grabs run inside
+    grabbing(host), which writes begin and end markers into the same pipe,
+    so the reader knows which grabs were running when each line was
+    written. A line without a URL is attributed to the camera host if every
+    grab running at that moment was of that host. Lines written while
+    several hosts were being grabbed stay unattributed, as host '-'.
+    """
+
+    hostPattern = re.compile(r'(?:tcp|http|https|rtsp|udp)://([^/\s?\'"]+)')
+    # ffmpeg prefixes lines with "[http @ 0x55d0c8a4f2c0]", OpenCV with "[ WARN:3@0.114]"
+    componentPattern = re.compile(r'^\[\s*(\w+)(?: @ 0x[0-9a-fA-F]+|:\d+@[\d.]+)\]\s*')
+    # Our own log records also reach fd 2 through the root logger
+    logPattern = re.compile(r'^\[\d\d:\d\d:\d\d\]-\[')
+    # Starts the grab markers; no library output starts with a NUL
+    markerPrefix = '\0grab '
+    maxLineLength = 1024
+
+    def __init__(self, libc=None, cStderr=None, maxKeys=1000):
+        self.libc = libc
+        self.cStderr = cStderr
+        self.maxKeys = maxKeys
+        self.counts = {}
+        self.samples = {}
+        self.dropped = 0
+        self.active = {}
+        self.waiting = {}
+        self.tokens = itertools.count()
+        self.capturing = False
+        self.lock = threading.Lock()
+        self.thread = None
+
+    def __enter__(self):
+        self.flush()
+        self.savedFd = os.dup(2)
+        readFd, writeFd = os.pipe()
+        os.dup2(writeFd, 2)
+        os.close(writeFd)
+        self.thread = threading.Thread(target=self.drain, args=(readFd,),
+                                       name='stderr', daemon=True)
+        self.thread.start()
+        self.capturing = True
+        return self
+
+    def __exit__(self, *exc):
+        self.capturing = False
+        self.flush()
+        # Once fd 2 points back at the terminal the pipe has no writers left,
+        # so the reader sees EOF and finishes.
+        os.dup2(self.savedFd, 2)
+        os.close(self.savedFd)
+        self.thread.join(timeout=5)
+        return False
+
+    def flush(self):
+        sys.stderr.flush()
+        if self.libc is not None:
+            self.libc.fflush(self.cStderr)
+
+    def drain(self, readFd):
+        pending = b''
+        with os.fdopen(readFd, 'rb', buffering=0) as pipe:
+            while True:
+                chunk = pipe.read(65536)
+                if not chunk:
+                    break
+                lines = (pending + chunk).split(b'\n')
+                pending = lines.pop()[-self.maxLineLength:]
+                for line in lines:
+                    self.record(line[:self.maxLineLength].decode(errors='replace'))
+        if pending:
+            self.record(pending.decode(errors='replace'))
+
+    def mark(self, kind, token, host=''):
+        if self.capturing:
+            os.write(2, '{}{} {} {}\n'.format(self.markerPrefix, kind, token, host).encode())
+
+    @contextmanager
+    def grabbing(self, host):
+        """Attribute the errors written while the block runs to host, see the class docstring.
+
+        On leaving, waits (briefly) until the reader has caught up, so the
+        errors of the grab are counted by the time it is reported."""
+        token = next(self.tokens)
+        self.flush()
+        self.mark('begin', token, host)
+        try:
+            yield
+        finally:
+            caughtUp = threading.Event()
+            with self.lock:
+                self.waiting[token] = caughtUp
+            self.flush()
+            self.mark('end', token)
+            if self.capturing:
+                caughtUp.wait(1)
+            with self.lock:
+                self.waiting.pop(token, None)
+
+    def recordMarker(self, line):
+        kind, token, host = (line[len(self.markerPrefix):].split(' ', 2) + [''])[:3]
+        token = int(token)
+        with self.lock:
+            if kind == 'begin':
+                self.active[token] = host.strip()
+                return
+            self.active.pop(token, None)
+            caughtUp = self.waiting.pop(token, None)
+        if caughtUp is not None:
+            caughtUp.set()
+
+    @classmethod
+    def classify(cls, line):
+        """Return the (host, message) key of an ffmpeg error line. host is None if the line has no URL."""
+        host = None
+        match = cls.hostPattern.search(line)
+        if match:
+            host = match.group(1)
+        component = cls.componentPattern.match(line)
+        if component:
+            message = '{}: {}'.format(component.group(1), line[component.end():])
+        else:
+            message = line
+        if match:
+            message = message.replace(match.group(0), '')
+        return host, message.strip()
+
+    def record(self, line):
+        if line.startswith(self.markerPrefix):
+            self.recordMarker(line)
+            return
+        line = line.strip()
+        if not line or self.logPattern.match(line):
+            return
+        host, message = self.classify(line)
+        with self.lock:
+            if host is None:
+                hosts = set(self.active.values())
+                host = hosts.pop() if len(hosts) == 1 else '-'
+            key = (host, message)
+            if key in self.counts:
+                self.counts[key] += 1
+            elif len(self.counts) < self.maxKeys:
+                self.counts[key] = 1
+                self.samples[key] = line
+            else:
+                self.dropped += 1
+
+    def errorsFor(self, host):
+        """Return [(message, count)] recorded for a camera host, most frequent first."""
+        # Camera URLs often leave out the port that ffmpeg reports
+        hostname = host.split(':')[0]
+        with self.lock:
+            errors = [(message, count) for (errorHost, message), count in self.counts.items()
+                      if errorHost.split(':')[0] == hostname]
+        return sorted(errors, key=lambda error: -error[1])
+
+    def top(self, n=5):
+        """Return the n most frequent ((host, message), count) pairs."""
+        with self.lock:
+            return sorted(self.counts.items(), key=lambda item: -item[1])[:n]
+
+    def total(self):
+        with self.lock:
+            return sum(self.counts.values()) + self.dropped
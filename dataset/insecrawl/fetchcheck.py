@@ -0,0 +1,216 @@
+"""
+Check PageFetcher and CameraImageParser against a local stand-in of insecam.
+
+Starts an HTTP/1.1 keep-alive server on localhost that serves listing
+pages, either saved ones from a folder or generated ones, each after a
+fixed delay. All pages are fetched at several concurrency levels. The
+check verifies every camera on every page is parsed, that connections
+are reused, that a keep-alive connection the server closed is retried,
+and that pages go through the HttpCache: revalidated with a 304 once
+stale, and served without the network in offline mode. It reports pages per second, which should grow with concurrency
+rather than with the number of pages.
+
+Example:
+    python3 fetchcheck.py --pages 60 --delay 0.05 --concurrency 1,4,16
+    python3 fetchcheck.py --saved saved_pages/
+"""
+
+import argparse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import os
+import sys
+import tempfile
+import threading
+import time
+
+from HttpCache import HttpCache
+from PageFetcher import CameraImageParser, PageFetcher
+
+
+def generatedPage(page, camerasPerPage):
+    cameras = ''.join(
+        '<div class="thumbnail-item"><a href="/en/view/{0}/">'
+        '<img id="image{0}" class="thumbnail-item__img" src="http://10.0.{1}.{2}:8080/mjpg/video.mjpg" '
+        'title="Live camera {0}"/></a></div>\n'.format(page * 1000 + i, page % 250, i)
+        for i in range(camerasPerPage))
+    return ('<html><head><title>Page {}</title></head><body>\n{}'
+            '<img src="//counter.yandex.ru/hit" id="image0"/>\n'
+            '<script>pagenavigator("?page=", 99, {});</script></body></html>').format(page, cameras, page).encode()
+
+
+class StandIn(ThreadingHTTPServer):
+    daemon_threads = True
+    # The default backlog of 5 drops connects above that and stalls them for a second
+    request_queue_size = 128
+
+    def __init__(self, pages, delay, closeEvery):
+        super().__init__(('127.0.0.1', 0), StandInHandler)
+        self.pages = pages
+        self.delay = delay
+        self.closeEvery = closeEvery
+        self.connections = 0
+        self.requests = 0
+        self.notModified = 0
+        self.lock = threading.Lock()
+
+    @property
+    def url(self):
+        return 'http://127.0.0.1:{}'.format(self.server_address[1])
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # Buffer headers and body into one write, or Nagle and delayed ACKs add ~40 ms per page
+    wbufsize = -1
+
+    def setup(self):
+        super().setup()
+        self.served = 0
+        with self.server.lock:
+            self.server.connections += 1
+
+    def do_GET(self):
+        page = int(self.path.rsplit('=', 1)[-1]) if '=' in self.path else 1
+        body = self.server.pages.get(page)
+        time.sleep(self.server.delay)
+        with self.server.lock:
+            self.server.requests += 1
+        if body is None:
+            self.send_error(404)
+            return
+        etag = '"page-{}"'.format(page)
+        if self.headers.get('If-None-Match') == etag:
+            with self.server.lock:
+                self.server.notModified += 1
+            self.send_response(304)
+            self.send_header('ETag', etag)
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header('ETag', etag)
+        self.send_header('Content-Type', 'text/html')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+        self.served += 1
+        if self.server.closeEvery and self.served >= self.server.closeEvery:
+            # Close without announcing it, like a server whose keep-alive timeout ran out
+            self.close_connection = True
+
+    def log_message(self, format, *args):
+        pass
+
+
+def loadPages(args):
+    if args.saved:
+        names = sorted(name for name in os.listdir(args.saved) if name.endswith(('.html', '.htm')))
+        pages = {}
+        for page, name in enumerate(names, start=1):
+            with open(os.path.join(args.saved, name), 'rb') as f:
+                pages[page] = f.read()
+        return pages
+    return {page: generatedPage(page, args.cameras) for page in range(1, args.pages + 1)}
+
+
+def checkCache(pages, expected):
+    """Fill a cache, revalidate it, then read it back offline with the server gone."""
+    failures = []
+    with tempfile.TemporaryDirectory() as folder:
+        server = StandIn(pages, 0, 0)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        urls = ['{}/en/bycountry/XX/?page={}'.format(server.url, page) for page in pages]
+        for ttl, step in ((300, 'filling'), (0, 'revalidating')):
+            results = {}
+            PageFetcher(4, cache=HttpCache(folder), ttl=ttl).run(
+                urls, lambda url, status, body: results.__setitem__(int(url.rsplit('=', 1)[-1]), (status, body)))
+            if any(results.get(page, (None,))[0] != 200 or CameraImageParser.extract(results[page][1]) != cameras
+                   for page, cameras in expected.items()):
+                failures.append('cache: pages wrong while {} the cache'.format(step))
+        if server.requests != 2 * len(pages) or server.notModified != len(pages):
+            failures.append('cache: {} requests and {} 304s for {} pages, expected one fill and one 304 each'.format(
+                server.requests, server.notModified, len(pages)))
+        server.shutdown()
+        server.server_close()
+
+        results = {}
+        PageFetcher(4, timeout=2, cache=HttpCache(folder, offline=True), ttl=0).run(
+            urls, lambda url, status, body: results.__setitem__(int(url.rsplit('=', 1)[-1]), (status, body)))
+        if any(results.get(page, (None,))[0] != 200 for page in pages):
+            failures.append('cache: offline mode did not serve every page from the cache')
+        results = {}
+        PageFetcher(1, timeout=2, cache=HttpCache(folder, offline=True)).run(
+            [server.url + '/uncached'], lambda url, status, body: results.__setitem__(url, status))
+        if list(results.values()) != [None]:
+            failures.append('cache: an uncached page in offline mode was not reported as failed')
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--pages', type=int, default=40, help='Generated pages to serve')
+    parser.add_argument('--cameras', type=int, default=6, help='Cameras per generated page')
+    parser.add_argument('--saved', help='Folder of saved listing pages to serve instead')
+    parser.add_argument('--delay', type=float, default=0.05, help='Seconds the server takes per page')
+    parser.add_argument('--closeEvery', type=int, default=5,
+                        help='Requests after which the server silently closes a connection')
+    parser.add_argument('--concurrency', default='1,4,16', help='Comma separated concurrency levels')
+    args = parser.parse_args()
+
+    pages = loadPages(args)
+    if not pages:
+        sys.exit('No pages to serve')
+    expected = {page: CameraImageParser.extract(body) for page, body in pages.items()}
+    failures = []
+
+    print('{:>12}{:>8}{:>10}{:>13}{:>10}'.format('concurrency', 'pages', 'seconds', 'connections', 'pages/s'))
+    for concurrency in [int(level) for level in args.concurrency.split(',')]:
+        server = StandIn(pages, args.delay, args.closeEvery)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        urls = ['{}/en/bycountry/XX/?page={}'.format(server.url, page) for page in pages]
+        results = {}
+
+        def onPage(url, status, body):
+            results[int(url.rsplit('=', 1)[-1])] = (status, body)
+
+        started = time.perf_counter()
+        PageFetcher(concurrency).run(urls, onPage)
+        elapsed = time.perf_counter() - started
+        server.shutdown()
+        server.server_close()
+
+        for page, cameras in expected.items():
+            status, body = results.get(page, (None, 'missing'))
+            if status != 200:
+                failures.append('concurrency {}: page {} failed: {}'.format(concurrency, page, body))
+            elif CameraImageParser.extract(body) != cameras:
+                failures.append('concurrency {}: page {} parsed differently'.format(concurrency, page))
+        if server.requests != len(pages):
+            failures.append('concurrency {}: {} requests for {} pages'.format(concurrency, server.requests, len(pages)))
+        # Each connection serves closeEvery pages before the server drops it
+        if args.closeEvery and server.connections > len(pages) // args.closeEvery + concurrency:
+            failures.append('concurrency {}: {} connections for {} pages, keep-alive not reused'.format(
+                concurrency, server.connections, len(pages)))
+        print('{:>12}{:>8}{:>10.2f}{:>13}{:>10.1f}'.format(
+            concurrency, len(pages), elapsed, server.connections, len(pages) / elapsed))
+
+    failures.extend(checkCache(pages, expected))
+
+    # A host that refuses connections is reported once per page, without retries
+    server = StandIn(pages, 0, 0)
+    deadURL = server.url
+    server.server_close()
+    errors = []
+    started = time.perf_counter()
+    PageFetcher(2, timeout=2).run([deadURL + '/?page=1'], lambda url, status, body: errors.append((status, body)))
+    if len(errors) != 1 or errors[0][0] is not None or time.perf_counter() - started > 2:
+        failures.append('refused connection was not reported promptly: {}'.format(errors))
+
+    if failures:
+        print('\n'.join(['FAILED'] + failures))
+        sys.exit(1)
+    print('OK: {} cameras on {} pages parsed at every concurrency level'.format(
+        sum(len(cameras) for cameras in expected.values()), len(pages)))
+
+
+if __name__ == '__main__':
+    main()
@@ -24,28 +24,36 @@ DEFAULT_SIZE_TOL       = 30     # percent
 DEFAULT_MIN_DWELL_TIME = 2      # seconds
 
 # ROI globals
-roi_points = []
-roi_selected = False
-ROI_COORDS = None
+roi_points = []     # Points of the polygon being drawn
+ROI_COORDS = []     # One polygon per rack, in display coordinates. Fill in to skip drawing them
+ROI_LABELS = []     # Names of the polygons in ROI_COORDS, defaults to "Rack 1", "Rack 2", ...
 
-# --- Mouse callback: select polygon ROI ---
+# --- Mouse callback: select polygon ROIs ---
 def select_roi_callback(event, x, y, flags, param):
-    global roi_points, roi_selected, ROI_COORDS
-    if not roi_selected and event == cv2.EVENT_LBUTTONDOWN:
+    global roi_points
+    if event == cv2.EVENT_LBUTTONDOWN:
         roi_points.append((x, y))
-    elif not roi_selected and event == cv2.EVENT_RBUTTONDOWN and len(roi_points) >= 3:
-        ROI_COORDS = np.array(roi_points, dtype=np.int32)
-        roi_selected = True
-        print(f"ROI selected with {len(roi_points)} points.")
+    elif event == cv2.EVENT_RBUTTONDOWN and len(roi_points) >= 3:
+        ROI_COORDS.append(np.array(roi_points, dtype=np.int32))
+        print(f"ROI {len(ROI_COORDS)} selected with {len(roi_points)} points.")
+        roi_points = []
 
 # --- Helper: draw ROI polygon ---
-def draw_roi_polygon(frame, roi_coords, color=(0,255,0), thickness=2):
+def draw_roi_polygon(frame, roi_coords, color=(0,255,0), thickness=2, label="ROI"):
     if roi_coords is not None and len(roi_coords) >= 3:
         pts = np.array(roi_coords, dtype=np.int32)
         cv2.polylines(frame, [pts], True, color, thickness)
-        cv2.putText(frame, "ROI", (pts[0][0], pts[0][1]-10),
+        cv2.putText(frame, label, (pts[0][0], pts[0][1]-10),
                     cv2.FONT_HERSHEY_SIMPLEX, 0.5, color, thickness)
 
+# --- Helper: rasterize all ROIs into one label mask ---
+def build_label_mask(shape, polygons):
+    """Pixels of ROI i are labeled i+1, everything else 0. Where ROIs overlap the later one wins."""
+    label_mask = np.zeros(shape, dtype=np.int32)
+    for label, polygon in enumerate(polygons, start=1):
+        cv2.fillPoly(label_mask, [np.asarray(polygon, dtype=np.int32)], label)
+    return label_mask
+
 # --- Main ---
 if __name__ == '__main__':
     # Settings GUI
@@ -64,8 +72,10 @@ if __name__ == '__main__':
         print(f"Error opening video: {VIDEO_SOURCE}")
         exit()
 
-    # ROI selection
-    print("Draw ROI: left-click to add points, right-click to finalize.")
+    # ROI selection, skipped when ROI_COORDS is filled in above
+    rois_preset = len(ROI_COORDS) > 0
+    if not rois_preset:
+        print("Draw ROIs: left-click to add points, right-click to close a rack. Press any key to start.")
     cv2.namedWindow("Video Feed")
     cv2.setMouseCallback("Video Feed", select_roi_callback)
     while True:
@@ -91,10 +101,11 @@ if __name__ == '__main__':
             cv2.circle(disp, p, 3, (0,0,255), -1)
             if i > 0:
                 cv2.line(disp, roi_points[i-1], p, (0,255,255), 2)
-        if roi_selected:
-            # draw_roi_polygon uses coordinates relative to the current frame (which is resized)
-            draw_roi_polygon(disp, ROI_COORDS, (0,255,0))
-            cv2.putText(disp, "ROI finalized. Press any key to start.", (10,30),
+        # draw_roi_polygon uses coordinates relative to the current frame (which is resized)
+        for i, roi in enumerate(ROI_COORDS):
+            draw_roi_polygon(disp, roi, (0,255,0), label=f"Rack {i+1}")
+        if ROI_COORDS and not roi_points:
+            cv2.putText(disp, f"{len(ROI_COORDS)} ROI(s). Draw another or press any key to start.", (10,30),
                         cv2.FONT_HERSHEY_SIMPLEX, 0.7, (0,255,0),2)
         else:
             cv2.putText(disp, "Define ROI: left-click, right-click to finish.", (10,30),
@@ -104,24 +115,28 @@ if __name__ == '__main__':
         key = cv2.waitKey(33) & 0xFF
         if key == ord('q'):
             cap.release(); cv2.destroyAllWindows(); exit()
-        if roi_selected:
+        if rois_preset or (key != 255 and ROI_COORDS and not roi_points):
             # Store the scale factor and dimensions used for processing
             process_width = DISPLAY_WIDTH
             process_height = new_h
             break # Exit loop
 
-    # Prepare ROI mask using resized dimensions
+    labels = [ROI_LABELS[i] if i < len(ROI_LABELS) else f"Rack {i+1}" for i in range(len(ROI_COORDS))]
+
+    # Prepare the ROI label mask using resized dimensions
     gray0 = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
-    roi_mask = np.zeros_like(gray0, dtype=np.uint8) # Use shape of resized gray image
     # ROI_COORDS are already relative to the resized frame
-    cv2.fillPoly(roi_mask, [ROI_COORDS], 255)
-    total_roi_px = np.count_nonzero(roi_mask)
-    if total_roi_px == 0: total_roi_px = 1 # Avoid division by zero
+    label_mask = build_label_mask(gray0.shape, ROI_COORDS)
+    roi_mask = np.where(label_mask > 0, 255, 0).astype(np.uint8) # Union of all ROIs
+    n_rois = len(ROI_COORDS)
+    total_roi_px = np.bincount(label_mask.ravel(), minlength=n_rois+1)[1:]
+    total_roi_px[total_roi_px == 0] = 1 # Avoid division by zero
 
     # Initialize prev_gray using resized dimensions
     prev_gray = gray0.copy()
-    motion_active = False
-    motion_start = 0
+    # Dwell and event state of every rack
+    motion_active = np.zeros(n_rois, dtype=bool)
+    motion_start = np.zeros(n_rois)
 
     print("Starting motion detection. Press 'q' to quit.")
     while True:
@@ -171,25 +186,29 @@ if __name__ == '__main__':
             valid.append(c)
             cv2.drawContours(valid_mask, [c], -1, 255, -1)
 
-        pct = np.count_nonzero(valid_mask)/total_roi_px # Percentage relative to resized ROI
+        # Moving pixels per rack in one pass: count the labels under the valid motion
+        moving_px = np.bincount(label_mask[valid_mask > 0], minlength=n_rois+1)[1:]
+        pct = moving_px/total_roi_px # Fraction of each resized ROI
 
-        # event logic
+        # event logic, independently per rack
         now = time.time()
-        if pct>=min_pct and not motion_active:
-            motion_active = True
-            motion_start = now
-        elif pct<min_pct and motion_active:
-            dwell = now-motion_start
+        started = (pct >= min_pct) & ~motion_active
+        ended = (pct < min_pct) & motion_active
+        motion_start[started] = now
+        for i in np.nonzero(ended)[0]:
+            dwell = now-motion_start[i]
             if dwell>=min_dwell:
-                print(f"Loiterer detected: {dwell:.1f}s @ {datetime.now()}")
-            motion_active = False
+                print(f"Loiterer detected at {labels[i]}: {dwell:.1f}s @ {datetime.now()}")
+        motion_active = (motion_active | started) & ~ended
 
         # display (using resized frame 'disp')
         disp = frame.copy() # Copy the resized frame
         # ROI_COORDS and valid contours are relative to resized frame
-        draw_roi_polygon(disp, ROI_COORDS, (0,0,255) if motion_active else (0,255,0))
+        for i, roi in enumerate(ROI_COORDS):
+            draw_roi_polygon(disp, roi, (0,0,255) if motion_active[i] else (0,255,0), label=labels[i])
+            cv2.putText(disp, f"{labels[i]} motion%: {pct[i]*100:5.1f}%", (10,30+25*i),
+                        cv2.FONT_HERSHEY_SIMPLEX,0.7,(255,255,255),2)
         cv2.drawContours(disp, valid, -1, (0,0,255),2)
-        cv2.putText(disp, f"Motion%: {pct*100:5.1f}%", (10,30), cv2.FONT_HERSHEY_SIMPLEX,0.7,(255,255,255),2)
 
         cv2.imshow("Video Feed", disp) # Show resized frame
         cv2.imshow("Motion Mask", valid_mask) # Show resized mask
@@ -1,25 +1,33 @@
-from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor, as_completed
 import ctypes
 from datetime import datetime
 import getopt
-import glob
-import io
 import json
 import logging
-import multiprocessing
 import os
 import platform
 import re
 import sys
-import tempfile
+import threading
 import time
 import urllib
-from urllib.request import Request, urlopen
 import cv2
 from bs4 import BeautifulSoup
 from iso3166 import countries
 
-from Counter import Counter
+from CameraIndex import CameraIndex
+from CaptureLog import CaptureLog
+from Counter import CounterSet
+from CountryJob import CountryJob
+from GrabEngine import GrabEngine
+from GrabPool import GrabPool
+from HttpCache import HttpCache
+import ImageCodec
+from ImageStore import ImageStore
+from PageFetcher import CameraImageParser, PageFetcher
+from ProgressReporter import ProgressReporter
+from Scheduler import CrawlScheduler
+from StderrCapture import StderrCapture
 
 
 class Insecrawl:
@@ -43,6 +51,8 @@ class Insecrawl:
         self.logger.addHandler(self.handler)
         # Logger setup finished
 
+        # Overridable so that crawls can be pointed at a local stand-in server.
+        self.insecamURL = os.environ.get('INSECAM_URL', 'http://www.insecam.org')
         self.cameraDetails = {'id': False, 'country': False, 'countryCode': False,
                               'manufacturer': False, 'ip': False, 'tags': [], 'insecamURL': False, 'directURL': False}
         self.countriesJSON = False
@@ -50,26 +60,55 @@ class Insecrawl:
         self.customIdentifier = False
         self.customURL = False
         self.downloadFolder = "images"
-        self.erroredScrapes = Counter()
         self.newCamerasOnly = False
         self.oneCamera = False
         self.printAmount = False
         self.printDetails = False
-        self.progressCounter = Counter()
-        self.skippedImages = Counter()
         self.scrapeAllCams = False
         self.sortByCountry = False
         self.sortByCamera = False
         self.startTime = datetime.now()
-        self.successfulScrapes = Counter()
         self.timeStamp = False
         self.verboseLogging = False
         self.interval = 0
+        self.maxWorkers = 12
+        self.perHostLimit = 2
+        self.asyncPages = 0
+        self.connectTimeout = 10
+        self.readTimeout = 10
+        self.keepDuplicates = False
+        self.dedupeDistance = None
+        self.minInterval = None
+        self.maxInterval = None
+        self.maxGrabRate = 10
+        self.priorityCams = []
+        self.offline = False
+        # Seconds a cached insecam response is used before it is revalidated
+        self.cacheTTL = {'countries': 3600, 'pages': 300, 'details': 86400}
+        self.maxCountries = 4
+        self.detect = False
+        self.alertsURL = None
+        self.workflow = None
+        self.docksFile = None
+        self.eventAggregator = None
+        self.alertWriter = None
+        self.noDisk = False
+        self.interrupted = False
+        # Set on CTRL+C; country crawls stop queueing pages and grabs
+        self.stopping = threading.Event()
+        # Seconds to keep writing queued alerts on exit
+        self.alertsTimeout = 30
+        self.keepOpenBelow = 60
+        self.maxSessions = 64
+        self.tiers = ['archive']
+        self.quality = None
         fullCmdArguments = sys.argv
         argumentList = fullCmdArguments[1:]
         unixOptions = "tvhc:ld:o:f:u:i:nS"
         gnuOptions = ["verbose", "help",
-                      "country=", "listCountries", "details=", "oneCamera=", "timeStamp", "folder=", "url=", "identifier=", "scrapeAllCameras", "sortByCountry", "sortByCamera", "newCamsOnly", "interval="]
+                      "country=", "listCountries", "details=", "oneCamera=", "timeStamp", "folder=", "url=", "identifier=", "scrapeAllCameras", "sortByCountry", "sortByCamera", "newCamsOnly", "interval=", "workers=", "perHost=", "asyncPages=", "connectTimeout=", "readTimeout=", "keepDuplicates", "dedupeDistance=",
+                      "minInterval=", "maxInterval=", "maxGrabRate=", "priorityCams=", "offline", "countries=", "detect", "noDisk", "alertsURL=",
+                      "workflow=", "docks=", "keepOpenBelow=", "maxSessions=", "tiers=", "quality="]
 
         try:
             arguments, _ = getopt.getopt(
@@ -112,8 +151,88 @@ class Insecrawl:
                 self.newCamerasOnly = True
             elif currentArgument in ("--interval"):
                 self.interval= int(currentValue)
+            elif currentArgument in ("--workers"):
+                self.maxWorkers = max(1, int(currentValue))
+            elif currentArgument in ("--perHost"):
+                self.perHostLimit = max(1, int(currentValue))
+            elif currentArgument in ("--asyncPages"):
+                self.asyncPages = max(1, int(currentValue))
+            elif currentArgument in ("--connectTimeout"):
+                self.connectTimeout = float(currentValue)
+            elif currentArgument in ("--readTimeout"):
+                self.readTimeout = float(currentValue)
+            elif currentArgument in ("--keepDuplicates"):
+                self.keepDuplicates = True
+            elif currentArgument in ("--dedupeDistance"):
+                self.dedupeDistance = min(64, max(0, int(currentValue)))
+            elif currentArgument in ("--minInterval"):
+                self.minInterval = int(currentValue)
+            elif currentArgument in ("--maxInterval"):
+                self.maxInterval = int(currentValue)
+            elif currentArgument in ("--maxGrabRate"):
+                self.maxGrabRate = float(currentValue)
+            elif currentArgument in ("--priorityCams"):
+                self.priorityCams = [cameraID.strip() for cameraID in currentValue.split(',')]
+            elif currentArgument in ("--offline"):
+                self.offline = True
+            elif currentArgument in ("--countries"):
+                self.maxCountries = max(1, int(currentValue))
+            elif currentArgument in ("--detect"):
+                self.detect = True
+            elif currentArgument in ("--alertsURL"):
+                self.alertsURL = currentValue
+            elif currentArgument in ("--workflow"):
+                self.workflow = currentValue
+            elif currentArgument in ("--docks"):
+                self.docksFile = currentValue
+            elif currentArgument in ("--noDisk"):
+                self.noDisk = True
+            elif currentArgument in ("--keepOpenBelow"):
+                self.keepOpenBelow = int(currentValue)
+            elif currentArgument in ("--maxSessions"):
+                self.maxSessions = int(currentValue)
+            elif currentArgument in ("--tiers"):
+                # The archive tier is what the camera index and capture log point at
+                self.tiers = ['archive'] + [tier.strip() for tier in currentValue.split(',')
+                                            if tier.strip() and tier.strip() != 'archive']
+                unknown = [tier for tier in self.tiers if tier not in ImageCodec.TIERS]
+                if unknown:
+                    print("Unknown tier: {}. Use one of: {}".format(
+                        ', '.join(unknown), ', '.join(ImageCodec.TIERS)))
+                    sys.exit(2)
+            elif currentArgument in ("--quality"):
+                self.quality = min(100, max(1, int(currentValue)))
         if len(arguments) == 0:
             print("No arguments given. Use -h for help.")
+        if self.docksFile and not self.workflow:
+            # The default workflow slices the whole frame itself
+            print("--docks needs --workflow with a plain (non-SAHI) detection workflow.")
+            sys.exit(2)
+
+        self.httpCache = HttpCache(offline=self.offline)
+        self.grabPool = GrabPool(self.maxWorkers, self.perHostLimit)
+        # One shard per grab worker and country worker, plus one for the main thread.
+        self.stats = CounterSet(['progress', 'successful', 'errored', 'skipped'],
+                                shards=self.maxWorkers + self.maxCountries + 1)
+        self.progressCounter = self.stats.counter('progress')
+        self.successfulScrapes = self.stats.counter('successful')
+        self.erroredScrapes = self.stats.counter('errored')
+        self.skippedImages = self.stats.counter('skipped')
+        self.progress = ProgressReporter(self.stats, self.LoadingBar)
+        # Kept for the lifetime of the crawler, so hosts known to be dead stay
+        # skipped across --interval cycles.
+        self.grabEngine = GrabEngine(self.connectTimeout, self.readTimeout,
+                                     maxSessions=self.maxSessions,
+                                     sessionIdle=max(self.keepOpenBelow * 2, 30),
+                                     perHost=self.perHostLimit)
+        # When frames go to the detector, saving them must not hold up the grab.
+        self.imageStore = ImageStore(dedupe=not self.keepDuplicates, asyncWrites=self.detect,
+                                     tiers=self.tiers, quality=self.quality,
+                                     maxDistance=self.dedupeDistance)
+        self.frameDetector = None
+        self.cameraIndexes = {}
+        self.captureLogs = {}
+        self.folderStoresLock = threading.Lock()
 
         if self.country:
             self.GetCountriesJSON()
@@ -130,52 +249,39 @@ class Insecrawl:
                     'Could not resolve {} to a country.'.format(self.country))
                 sys.exit(self.RaiseCritical())
 
+        self.streamErrors = None
         if not self.verboseLogging:
-            # Wrap main function in stderr_redirector to suppress those pesky ffmpeg errors.
-            # Downside: stderr will not be visible on screen.
+            # Capture stderr while main runs to keep those pesky ffmpeg errors off
+            # the screen. They are tallied per camera host instead.
             if operating_system != 'Windows':
-                f = io.StringIO()
-                with self.stderr_redirector(f):
+                self.streamErrors = StderrCapture(self.libc, self.c_stderr)
+                with self.streamErrors:
                     self.main()
-                f.close
             else:
                 self.main()
         elif self.verboseLogging:
             self.logger.removeHandler(self.handler)
             self.main()
 
-    @contextmanager
-    def stderr_redirector(self, stream):
-        original_stderr_fd = sys.stderr.fileno()
-
-        def _redirect_stderr(to_fd):
-            self.libc.fflush(self.c_stderr)
-            sys.stderr.close()
-            os.dup2(to_fd, original_stderr_fd)
-            sys.stderr = io.TextIOWrapper(os.fdopen(original_stderr_fd, 'wb'))
-
-        saved_stderr_fd = os.dup(original_stderr_fd)
-        try:
-            tfile = tempfile.TemporaryFile(mode='w+b')
-            _redirect_stderr(tfile.fileno())
-            yield
-            _redirect_stderr(saved_stderr_fd)
-            tfile.flush()
-            tfile.seek(0, io.SEEK_SET)
-            stream.write(tfile.read().decode())
-        finally:
-            tfile.close()
-            os.close(saved_stderr_fd)
+    def StreamErrorSummary(self, cameraURL):
+        """Most frequent stderr error seen for the host of cameraURL, for failure logs."""
+        if self.streamErrors is None:
+            return ""
+        errors = self.streamErrors.errorsFor(urllib.parse.urlparse(cameraURL).netloc)
+        if not errors:
+            return ""
+        message, count = errors[0]
+        return " ({}, seen {} times)".format(message, count)
 
     def GetCountriesJSON(self):
         """Fetch a JSON of country codes, countries and camera count"""
         try:
             # Insecam seems to have dropped HTTPS protocol in favor of HTTP
-            url = 'http://www.insecam.org/en/jsoncountries/'
+            url = '{}/en/jsoncountries/'.format(self.insecamURL)
             headers = {
                 'User-Agent': 'Mozilla/5.0 (Windows NT 6.1) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/41.0.2228.0 Safari/537.3'}
-            req = Request(url=url, headers=headers)
-            countriesjson = json.loads(urlopen(req).read().decode())
+            countriesjson = self.httpCache.getParsed(
+                url, headers, self.cacheTTL['countries'], self.ParseCountriesJSON)
             self.countriesJSON = countriesjson['countries']
             self.countriesJSON['-']['country'] = "Unknown location"
             if self.country:
@@ -183,6 +289,9 @@ class Insecrawl:
         except:
             self.logger.error("Could not fetch countries JSON from insecam")
 
+    def ParseCountriesJSON(self, body):
+        return json.loads(body.decode())
+
     def PrintCameraCount(self):
         countriesTotalAmount = 0
         camerasTotalAmount = 0
@@ -237,66 +346,78 @@ class Insecrawl:
         except FileExistsError:
             pass
 
-    def GetMaxPageNum(self):
+    def GetMaxPageNum(self, job):
         """Returns maximum number of camera pages for a certain country."""
         try:
-            url = 'http://www.insecam.org/en/bycountry/{}/'.format(
-                self.country)
+            url = '{}/en/bycountry/{}/'.format(
+                self.insecamURL, job.country)
             headers = {
                 'User-Agent': 'Mozilla/5.0 (Windows NT 6.1) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/41.0.2228.0 Safari/537.3'}
-            req = Request(url=url, headers=headers)
-            html = urlopen(req).read()
-
-            soup = BeautifulSoup(html, features="html.parser")
-            maxPages = ""
-            for script in soup.find_all('script'):
-                match = re.search(
-                    r'pagenavigator\("\?page=", (\d+), \d+\);', script.get_text())
-                if match:
-                    maxPages = match.group(1)
-            return maxPages
+            # Pages without a page navigator list no cameras
+            return int(self.httpCache.getParsed(url, headers, self.cacheTTL['pages'], self.ParseMaxPageNum) or 0)
         except urllib.error.HTTPError:
             self.logger.error(
-                'Country code {} ({}) returned 404! Insecam has no cameras from this country'.format(self.country, self.countryName))
+                'Country code {} ({}) returned 404! Insecam has no cameras from this country'.format(job.country, job.countryName))
+            if self.scrapeAllCams:
+                # One missing country should not end a crawl of all of them.
+                return 0
             sys.exit(self.RaiseCritical())
 
-    def GetDetails(self):
-        """Get details for a camera"""
-        url = 'http://www.insecam.org/en/view/{}/'.format(
-            self.cameraDetails['id'])
+    def ParseMaxPageNum(self, html):
+        soup = BeautifulSoup(html, features="html.parser")
+        maxPages = ""
+        for script in soup.find_all('script'):
+            match = re.search(
+                r'pagenavigator\("\?page=", (\d+), \d+\);', script.get_text())
+            if match:
+                maxPages = match.group(1)
+        return maxPages
+
+    def FetchCameraPage(self, cameraID):
+        """Return the parsed details of a camera's insecam page."""
+        url = '{}/en/view/{}/'.format(self.insecamURL, cameraID)
         self.cameraDetails['insecamURL'] = url
         headers = {
             'User-Agent': 'Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/51.0.2704.103 Safari/537.36'}
-        req = Request(url=url, headers=headers)
+        return self.httpCache.getParsed(url, headers, self.cacheTTL['details'], self.ParseDetails)
+
+    def ParseDetails(self, html):
+        """Parse a camera page. Only the details found on the page are included."""
+        details = {}
+        soup = BeautifulSoup(html, features="html.parser")
+        for link in soup.find_all('a'):
+            matchCountry = re.search(
+                r'\/en\/bycountry\/(\w+)\/', str(link))
+            if matchCountry:
+                details['countryCode'] = matchCountry.group(1)
+                details['country'] = link.get_text()
+            matchManufacturer = re.search(
+                r'\/en\/bytype\/(\w+)\/', str(link))
+            if matchManufacturer:
+                details['manufacturer'] = link.get_text()
+        for script in soup.find_all('script'):
+            match = re.findall(
+                r'addtagset\(\"(\w+)\"\);', script.get_text())
+            if match:
+                details['tags'] = match
+        for img in soup.findAll('img'):
+            if img.get('id') == "image0":
+                details['imageURL'] = img.get('src')
+                if img.get('src') == "/static/no.jpg":
+                    details['directURL'] = "NOT FOUND"
 
-        try:
-            html = urlopen(req).read()
-            soup = BeautifulSoup(html, features="html.parser")
-            for link in soup.find_all('a'):
-                matchCountry = re.search(
-                    r'\/en\/bycountry\/(\w+)\/', str(link))
-                if matchCountry:
-                    self.cameraDetails['countryCode'] = matchCountry.group(1)
-                    self.cameraDetails['country'] = link.get_text()
-                matchManufacturer = re.search(
-                    r'\/en\/bytype\/(\w+)\/', str(link))
-                if matchManufacturer:
-                    self.cameraDetails['manufacturer'] = link.get_text()
-            for script in soup.find_all('script'):
-                match = re.findall(
-                    r'addtagset\(\"(\w+)\"\);', script.get_text())
-                if match:
-                    self.cameraDetails['tags'] = match
-            for img in soup.findAll('img'):
-                if img.get('id') == "image0":
-                    if img.get('src') == "/static/no.jpg":
-                        self.cameraDetails['directURL'] = "NOT FOUND"
-
-                    else:
-                        url = urllib.parse.urlparse(img.get('src'))
-                        self.cameraDetails['directURL'] = "http://{}".format(
-                            url.netloc)
+                else:
+                    url = urllib.parse.urlparse(img.get('src'))
+                    details['directURL'] = "http://{}".format(
+                        url.netloc)
+        return details
 
+    def GetDetails(self):
+        """Get details for a camera"""
+        try:
+            details = self.FetchCameraPage(self.cameraDetails['id'])
+            self.cameraDetails.update(
+                {key: value for key, value in details.items() if key != 'imageURL'})
         except urllib.error.HTTPError:
             self.logger.error('Country not found!')
 
@@ -338,32 +459,67 @@ class Insecrawl:
             self.cameraDetails['directURL']))
         print("╚══════════════╝")
 
-    def WriteImage(self, cameraID, cameraURL, downloadFolder, totalCams):
-        """Capture still from camera, and write image to disk"""
-        # Errors from cv2 are printed to stderr, which has been suppressed in  the class constructor method
-        vidObj = cv2.VideoCapture(cameraURL)
-        success, image = vidObj.read()
-        if success:
+    def WriteImage(self, cameraID, cameraURL, downloadFolder, keepOpen=False):
+        """Capture still from camera, and write image to disk.
+
+        With keepOpen the camera's stream is kept open between grabs.
+        Returns the outcome of the grab as one of the CrawlScheduler outcomes."""
+        # Errors from cv2 are printed to stderr, which is captured in the class constructor method
+        if self.streamErrors is None:
+            status, image = self.grabEngine.grab(cameraURL, keepOpen)
+        else:
+            with self.streamErrors.grabbing(urllib.parse.urlparse(cameraURL).netloc):
+                status, image = self.grabEngine.grab(cameraURL, keepOpen)
+        if status == GrabEngine.SKIPPED:
+            self.skippedImages.increment()
+            outcome = CrawlScheduler.SKIPPED
+            self.logger.debug(
+                "Host of camera ID %s is failing repeatedly. Skipping", cameraID)
+        elif status == GrabEngine.OK:
             self.successfulScrapes.increment()
             timestampStr = ""
+            dateTimeObj = datetime.now()
             if self.timeStamp:
-                dateTimeObj = datetime.now()
                 timestampStr = dateTimeObj.strftime("[%Y-%m-%d]_[%H-%M-%S]")
-            if self.sortByCamera:
-                self.CreateDir(f'{downloadFolder}/{cameraID}')
-                cv2.imwrite(f'{downloadFolder}/{cameraID}/[{cameraID}]_{timestampStr}.jpg', image)
-                self.logger.debug(f'Image saved to {downloadFolder}/{cameraID}/[{cameraID}]_{timestampStr}.jpg')
+            if self.noDisk:
+                # Still tell the scheduler whether the picture changed, so
+                # static cameras back off without anything being written.
+                if self.imageStore.compare(cameraID, image):
+                    outcome = CrawlScheduler.UNCHANGED
+                else:
+                    outcome = CrawlScheduler.CHANGED
             else:
-                cv2.imwrite(f'{downloadFolder}/[{cameraID}]_{timestampStr}.jpg', image)
-                self.logger.debug(f'Image saved to {downloadFolder}/[{cameraID}]_{timestampStr}.jpg')
+                if self.sortByCamera:
+                    self.CreateDir(f'{downloadFolder}/{cameraID}')
+                    imagePath = f'{downloadFolder}/{cameraID}/[{cameraID}]_{timestampStr}.jpg'
+                else:
+                    imagePath = f'{downloadFolder}/[{cameraID}]_{timestampStr}.jpg'
+                storedPath, duplicate = self.imageStore.save(
+                    self.CameraIndexFor(downloadFolder), cameraID, image, imagePath,
+                    dateTimeObj.timestamp(), self.CaptureLogFor(downloadFolder))
+                if duplicate:
+                    outcome = CrawlScheduler.UNCHANGED
+                    self.logger.debug('Frame unchanged, kept reference to %s', storedPath)
+                else:
+                    outcome = CrawlScheduler.CHANGED
+                    self.logger.debug('Image saved to %s', storedPath)
+            # Frames repeating the camera's last one were already looked at
+            if self.frameDetector is not None and outcome == CrawlScheduler.CHANGED:
+                if not self.frameDetector.submit(image, {'cameraID': cameraID, 'url': cameraURL,
+                                                         'timestamp': dateTimeObj.isoformat()}):
+                    self.logger.debug('Detector queue full, dropped frame of camera ID %s', cameraID)
 
             self.logger.info(
-                'Scraped image from camera ID {}'.format(cameraID))
-        if not success:
+                'Scraped image from camera ID %s', cameraID)
+        else:
             self.erroredScrapes.increment()
-            self.logger.error("Failed to scrape camera ID {}".format(cameraID))
+            outcome = CrawlScheduler.FAILED
+            if not self.noDisk:
+                self.CaptureLogFor(downloadFolder).append(cameraID, time.time(), None, 0, None, False)
+            self.logger.error("Failed to scrape camera ID %s%s", cameraID,
+                              self.StreamErrorSummary(cameraURL))
         self.progressCounter.increment()
-        self.LoadingBar(self.progressCounter.value, totalCams)
+        return outcome
 
     def DownloadCustomURL(self):
         """Download a still frame from a user provided URL."""
@@ -377,8 +533,10 @@ class Insecrawl:
             self.logger.debug(
                 'START processing camera ID {}'.format(self.customURL))
             self.logger.debug('Image URL: {}'.format(self.customURL))
+            self.progress.begin(1)
             self.WriteImage(self.customIdentifier,
-                            self.customURL, self.downloadFolder, 1)
+                            self.customURL, self.downloadFolder)
+            self.progress.end()
             self.logger.debug(
                 'DONE processing camera ID {}'.format(self.customURL))
 
@@ -387,13 +545,7 @@ class Insecrawl:
 
     def ScrapeOne(self, cameraID):
         """Scrape image from one camera"""
-        url = 'http://www.insecam.org/en/view/{}/'.format(
-            cameraID)
-        self.cameraDetails['insecamURL'] = url
         self.CreateDir(self.downloadFolder)
-        headers = {
-            'User-Agent': 'Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/51.0.2704.103 Safari/537.36'}
-        req = Request(url=url, headers=headers)
 
         if self.customIdentifier:
             cameraName = self.customIdentifier
@@ -401,18 +553,17 @@ class Insecrawl:
             cameraName = cameraID
 
         try:
-            html = urlopen(req).read()
-            soup = BeautifulSoup(html, features="html.parser")
-            for img in soup.findAll('img'):
-                if img.get('id') == "image0":
-                    self.logger.debug(
-                        'START processing camera ID {}'.format(cameraID))
-                    image_url = img.get('src')
-                    self.logger.debug('Image URL: {}'.format(image_url))
-                    self.WriteImage(cameraName, image_url,
-                                    self.downloadFolder, 1)
-                    self.logger.debug(
-                        'DONE processing camera ID {}'.format(cameraID))
+            image_url = self.FetchCameraPage(cameraID).get('imageURL')
+            if image_url:
+                self.logger.debug(
+                    'START processing camera ID {}'.format(cameraID))
+                self.logger.debug('Image URL: {}'.format(image_url))
+                self.progress.begin(1)
+                self.WriteImage(cameraName, image_url,
+                                self.downloadFolder)
+                self.progress.end()
+                self.logger.debug(
+                    'DONE processing camera ID {}'.format(cameraID))
 
         except urllib.error.HTTPError:
             self.logger.error('Country not found!')
@@ -429,114 +580,272 @@ class Insecrawl:
         self.logger.info("Found {} cameras from {} countries. This could take a long time.".format(
             totalCams, totalCountries))
 
-        for key in sorted(self.countriesJSON.keys()):
-            JSONItem = self.countriesJSON[key]
-            self.country = key
-            self.countryName = JSONItem['country']
-            self.amountOfCameras = totalCams
-            self.ScrapePages(self.country, self.countryName)
-        sys.exit()
-
-    def ScrapeImages(self, page, totalCams):
-        """Save still images from a certain country and page number."""
-        url = 'http://www.insecam.org/en/bycountry/{}/?page={}'.format(
-            self.country, page)
-        headers = {
-            'User-Agent': 'Mozilla/5.0 (Windows NT 6.1) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/41.0.2228.0 Safari/537.3'}
-        req = Request(url=url, headers=headers)
+        self.amountOfCameras = totalCams
+        # Largest countries first, so the crawl is not left waiting on a big
+        # country that was started last.
+        jobs = [self.MakeJob(key, self.countriesJSON[key]['country'])
+                for key in sorted(self.countriesJSON.keys(),
+                                  key=lambda key: -self.countriesJSON[key]['count'])]
+        self.progress.begin(totalCams)
+        countryPool = ThreadPoolExecutor(max_workers=self.maxCountries,
+                                         thread_name_prefix='country')
         try:
-            html = urlopen(req).read()
-            soup = BeautifulSoup(html, features="html.parser")
-            images = soup.findAll('img')
-            for img in images:
-                image_url = img.get('src')
-                if "yandex" in image_url:
-                    self.logger.debug('Not a valid IP camera URL. Skipping...')
-                    self.logger.debug(
-                        'DONE processing img ID{}'.format(image_id))
-                    continue
-                if img.get('id') == None:
-                    self.logger.debug('Image has no id, skip')
-                    continue
-                if img.get('title') == "LiveInternet":
-                    self.logger.debug('Ignore another website bloatware')
-                    continue
-                match = re.search(r'image(\d+)', img.get('id'))
-                if match == None:
-                    self.logger.debug('No matches. Skipping')
+            crawls = {countryPool.submit(self.CrawlCountry, job): job for job in jobs}
+            for crawl in as_completed(crawls):
+                job = crawls[crawl]
+                try:
+                    crawl.result()
+                except Exception as err:
+                    # One country failing must not abort the rest of the crawl
+                    self.logger.error('Scraping cameras in {} failed: {}'.format(job.countryName, err))
                     continue
-                image_id = match.group(1)
+                self.logger.info(
+                    'Done scraping cameras in {}.'.format(job.countryName))
+        except KeyboardInterrupt:
+            self.StopCrawl()
+            raise
+        finally:
+            # Countries not started yet are dropped if the crawl is interrupted
+            countryPool.shutdown(wait=True, cancel_futures=True)
+        self.progress.end()
+        self.LogSummary()
+        self.QuitProgram()
 
-                self.logger.debug('START processing {}'.format(image_id))
-                self.logger.debug('Image URL: {}'.format(image_url))
+    def StopCrawl(self):
+        """Stop running country crawls at their next page or grab, and cancel
+        the grabs that have not started."""
+        self.stopping.set()
+        self.grabPool.cancelPending()
 
-                if self.newCamerasOnly:
-                    if not self.ImageExists(image_id):
-                        p = multiprocessing.Process(target=self.WriteImage, args=(
-                            image_id, image_url, self.downloadFolder, totalCams))
-                    else:
-                        self.LoadingBar(self.progressCounter.value, totalCams)
-                elif not self.newCamerasOnly:
-                    # Process image scrapes in batches of six. (Number of cameras per wep page.)
-                    p = multiprocessing.Process(target=self.WriteImage, args=(
-                        image_id, image_url, self.downloadFolder, totalCams))
-                    # self.progressCounter.increment()
-                    p.daemon = True
-                    p.start()
-                self.logger.debug(
-                    'DONE processing camera ID {}'.format(image_id))
-            try:
-                p.join()
-            except UnboundLocalError:
-                pass
-            except AssertionError:
-                pass
+    def MakeJob(self, countryCode, countryName):
+        """Create the crawl state for a country."""
+        downloadFolder = self.downloadFolder
+        if self.sortByCountry:
+            downloadFolder = "images/{}".format(countryName)
+        totalCams = self.countriesJSON[countryCode]['count']
+        if self.scrapeAllCams:
+            totalCams = self.amountOfCameras
+        return CountryJob(countryCode, countryName, downloadFolder, totalCams)
+
+    def QueueGrabs(self, job, cameras):
+        """Queue a grab for every (cameraID, imageURL) pair in cameras. Returns the futures."""
+        grabs = []
+        for image_id, image_url in cameras:
+            if self.stopping.is_set():
+                break
+            self.logger.debug('START processing %s', image_id)
+            self.logger.debug('Image URL: %s', image_url)
+
+            if not (self.newCamerasOnly and self.ImageExists(image_id, job.downloadFolder)):
+                grabs.append(self.grabPool.submit(image_url, self.WriteImage,
+                                                  image_id, image_url, job.downloadFolder))
+            self.logger.debug(
+                'DONE processing camera ID %s', image_id)
+        return grabs
 
+    def GetPageCameras(self, job, page):
+        """Return the (cameraID, imageURL) pairs listed on a page of the country."""
+        headers = {
+            'User-Agent': 'Mozilla/5.0 (Windows NT 6.1) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/41.0.2228.0 Safari/537.3'}
+        try:
+            return self.httpCache.getParsed(job.pageURL(self.insecamURL, page), headers, self.cacheTTL['pages'],
+                                            CameraImageParser.extract)
         except urllib.error.HTTPError:
             self.logger.error('Country not found!')
+            return []
 
-    def ScrapePages(self, countryCode, countryName):
-        """Scrape pages for a given country"""
-        page = 1
-        totalCamsOfCountry = self.countriesJSON[countryCode]['count']
-        if self.scrapeAllCams:
-            totalCamsOfCountry = self.amountOfCameras
-        self.maxPages = self.GetMaxPageNum()
+    def FetchPagesAsync(self, job, onCameras):
+        """Fetch every page of the country concurrently, calling onCameras(cameras) as pages arrive."""
+        headers = {
+            'User-Agent': 'Mozilla/5.0 (Windows NT 6.1) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/41.0.2228.0 Safari/537.3'}
+        fetcher = PageFetcher(self.asyncPages, headers=headers,
+                              cache=self.httpCache, ttl=self.cacheTTL['pages'], stop=self.stopping)
+        urls = [job.pageURL(self.insecamURL, page) for page in range(1, job.maxPages + 1)]
+
+        def onPage(url, status, body):
+            if status != 200:
+                self.logger.error('Could not fetch {} ({})'.format(url, body if status is None else status))
+                return
+            self.logger.debug('DONE scraping camera page %s', url)
+            onCameras(CameraImageParser.extract(body))
+
+        try:
+            fetcher.run(urls, onPage)
+        finally:
+            fetcher.close()
+
+    def ScrapeImages(self, job, page):
+        """Queue still image grabs for a certain country and page number.
+
+        Returns the futures of the queued grabs without waiting on them, so
+        the caller can fetch the next page while these are running."""
+        return self.QueueGrabs(job, self.GetPageCameras(job, page))
+
+    def ScrapeImagesAsync(self, job):
+        """Fetch every page of the country concurrently and queue grabs as pages arrive."""
+        grabs = []
+        self.FetchPagesAsync(job, lambda cameras: grabs.extend(self.QueueGrabs(job, cameras)))
+        return grabs
+
+    def ListCameras(self, job):
+        """Return a {cameraID: imageURL} dict of every camera listed for the country."""
+        job.maxPages = self.GetMaxPageNum(job)
+        cameras = {}
+        if self.asyncPages:
+            self.FetchPagesAsync(job, cameras.update)
+        else:
+            for page in range(1, job.maxPages + 1):
+                cameras.update(self.GetPageCameras(job, str(page)))
+        return cameras
+
+    def CrawlCountry(self, job):
+        """Grab every camera of a country once. Returns the job when all grabs are done."""
+        job.maxPages = self.GetMaxPageNum(job)
         self.logger.info(
-            'Scraping images from cameras in {}.'.format(countryName))
-        if self.sortByCountry:
-            self.downloadFolder = "images/{}".format(countryName)
-        self.CreateDir(self.downloadFolder)
-        while page <= int(self.maxPages):
-            self.logger.debug('START scraping camera page {} '.format(page))
-            self.ScrapeImages(str(page), totalCamsOfCountry)
-            self.logger.debug('DONE scraping camera page {} '.format(page))
-            page += 1
+            'Scraping images from cameras in {}.'.format(job.countryName))
+        self.CreateDir(job.downloadFolder)
+        if self.asyncPages:
+            self.grabPool.wait(self.ScrapeImagesAsync(job))
+        else:
+            # Pages are pipelined: the next page is fetched and parsed while the
+            # grabs queued from the previous one are still running.
+            pendingGrabs = []
+            page = 1
+            while page <= job.maxPages and not self.stopping.is_set():
+                self.logger.debug('START scraping camera page %s ', page)
+                grabs = self.ScrapeImages(job, str(page))
+                self.grabPool.wait(pendingGrabs)
+                pendingGrabs = grabs
+                self.logger.debug('DONE scraping camera page %s ', page)
+                page += 1
+            self.grabPool.wait(pendingGrabs)
+        return job
+
+    def ScrapePages(self, countryCode, countryName):
+        """Scrape pages for a given country. Returns the crawl state of the country."""
+        job = self.MakeJob(countryCode, countryName)
+        if self.newCamerasOnly:
+            job.skipCameras = set(self.CameraIndexFor(job.downloadFolder).cameraIDs())
+        self.progress.begin(job.totalCams)
+        self.CrawlCountry(job)
+        self.progress.end()
         self.logger.info(
             'Done scraping cameras in {}.'.format(countryName))
-        self.logger.info('Images downloaded: {}'.format(
-            self.successfulScrapes.value))
-        # self.successfulScrapes = 0
+        self.LogSummary()
+        self.stats.reset('skipped', 'errored')
+        return job
 
-        if self.skippedImages.value > 0:
+    def LogSummary(self):
+        stats = self.stats.snapshot()
+        self.logger.info('Images downloaded: {}'.format(stats['successful']))
+
+        if stats['skipped'] > 0:
             self.logger.info(
-                "Skipped cameras: {}".format(self.skippedImages.value))
-            self.skippedImages.reset()
-        if self.erroredScrapes.value > 0:
+                "Skipped cameras: {}".format(stats['skipped']))
+        if stats['errored'] > 0:
             self.logger.info(
-                'Failed scrapes: {}'.format(self.erroredScrapes.value))
-            self.erroredScrapes.reset()
-
-    def ImageExists(self, id):
-        for name in glob.glob('{}/{}*'.format(self.downloadFolder, id)):
-            if id in name:
-                self.logger.debug(
-                    "Image from ID {} found on disk. Skipping".format(id))
-                self.progressCounter.increment()
-                self.skippedImages.increment()
-                return True
+                'Failed scrapes: {}'.format(stats['errored']))
+        deadHosts = self.grabEngine.health.openHosts()
+        if deadHosts:
+            self.logger.info(
+                'Camera hosts in backoff: {}'.format(len(deadHosts)))
+        if self.streamErrors is not None and self.streamErrors.total() > 0:
+            self.logger.info(
+                'Stream errors: {}. Most frequent:'.format(self.streamErrors.total()))
+            for (host, message), count in self.streamErrors.top(5):
+                self.logger.info('  {}x {} {}'.format(count, host, message))
+
+    def ScheduleCameras(self, scheduler, job):
+        """Hand the current listing of the country to the scheduler."""
+        cameras = self.ListCameras(job)
+        if self.newCamerasOnly:
+            cameras = {cameraID: imageURL for cameraID, imageURL in cameras.items()
+                       if cameraID not in job.skipCameras}
+        scheduler.update(cameras)
+        self.logger.info('Scheduling {} cameras in {}, base interval {}s'.format(
+            len(scheduler), job.countryName, self.interval))
+
+    def RunScheduled(self, job):
+        """Grab the cameras of a country continuously, each on its own adaptive interval."""
+        scheduler = CrawlScheduler(self.interval, self.minInterval, self.maxInterval,
+                                   self.maxGrabRate, self.priorityCams)
+        # Keep the pool fed without letting due cameras pile up in its queue.
+        inFlight = threading.BoundedSemaphore(self.maxWorkers * 2)
+        listingInterval = max(self.interval * 10, 600)
+        nextSummary = time.monotonic() + self.interval
+        stopListing = threading.Event()
+
+        def refreshListing():
+            # Fetching the listing takes a while, so it runs beside the
+            # dispatch loop instead of holding up cameras that are due.
+            while True:
+                try:
+                    self.ScheduleCameras(scheduler, job)
+                except (Exception, SystemExit) as err:
+                    self.logger.error('Could not refresh the camera listing of {}: {}'.format(
+                        job.countryName, err))
+                if stopListing.wait(listingInterval):
+                    return
+
+        def grabDone(future, cameraID):
+            inFlight.release()
+            # Grabs still queued when the crawl shuts down are cancelled
+            if future.cancelled():
+                outcome = CrawlScheduler.SKIPPED
+            elif future.exception():
+                outcome = CrawlScheduler.FAILED
             else:
-                return False
+                outcome = future.result()
+            scheduler.done(cameraID, outcome)
+
+        threading.Thread(target=refreshListing, name='listing', daemon=True).start()
+        try:
+            while True:
+                now = time.monotonic()
+                if now >= nextSummary:
+                    self.LogSummary()
+                    self.stats.reset()
+                    nextSummary = now + self.interval
+                inFlight.acquire()
+                due = scheduler.next(timeout=1)
+                if due is None:
+                    inFlight.release()
+                    continue
+                cameraID, imageURL = due
+                # Cameras grabbed often keep their stream open between grabs.
+                keepOpen = scheduler.intervals[cameraID] <= self.keepOpenBelow
+                future = self.grabPool.submit(imageURL, self.WriteImage,
+                                              cameraID, imageURL, job.downloadFolder, keepOpen)
+                future.add_done_callback(lambda future, cameraID=cameraID: grabDone(future, cameraID))
+        finally:
+            stopListing.set()
+
+    def FolderStore(self, stores, storeClass, folder):
+        """Return the store of a download folder from stores, opening it on first use."""
+        with self.folderStoresLock:
+            store = stores.get(folder)
+            if store is None:
+                self.CreateDir(folder)
+                store = storeClass(folder)
+                stores[folder] = store
+            return store
+
+    def CameraIndexFor(self, folder):
+        """Return the camera index of a download folder, opening it on first use."""
+        return self.FolderStore(self.cameraIndexes, CameraIndex, folder)
+
+    def CaptureLogFor(self, folder):
+        """Return the capture log of a download folder, opening it on first use."""
+        return self.FolderStore(self.captureLogs, CaptureLog, folder)
+
+    def ImageExists(self, id, folder):
+        if id in self.CameraIndexFor(folder):
+            self.logger.debug(
+                "Image from ID %s found on disk. Skipping", id)
+            self.progressCounter.increment()
+            self.skippedImages.increment()
+            return True
+        return False
 
     def LoadingBar(self, current, max):
         """Loading bar graphix"""
@@ -571,42 +880,105 @@ class Insecrawl:
     def QuitProgram(self):
         """ Uniform quit, with time elapsed"""
 
+        try:
+            # After CTRL+C only the grabs already running are waited for
+            self.grabPool.shutdown(cancelPending=self.interrupted)
+            self.grabEngine.close()
+            self.imageStore.close()
+            if self.frameDetector is not None:
+                self.frameDetector.stop()
+                self.logger.info('Frames sent to the detector: {}, dropped: {}'.format(
+                    self.frameDetector.processed, self.frameDetector.dropped))
+        finally:
+            # Even if a second CTRL+C cut the shutdown short, incidents still
+            # open become alerts and queued alerts get written.
+            if self.eventAggregator is not None:
+                self.eventAggregator.flush(close_all=True)
+                self.alertWriter.stop(timeout=self.alertsTimeout)
+                self.logger.info('Alerts written: {}, dropped: {}'.format(
+                    self.alertWriter.written, self.alertWriter.dropped))
+        for index in self.cameraIndexes.values():
+            index.close()
+        # After the image store, so records of queued writes are in
+        for log in self.captureLogs.values():
+            log.close()
         timeElapsed = self.DeltaTime(datetime.now() - self.startTime)
         self.logger.info('Process completed in {}.'.format(timeElapsed))
         sys.exit()
 
+    def StartDetector(self):
+        """Stream grabbed frames straight into a batched BikeTheftDetector."""
+        # The detector lives in the backend package of this repository
+        backendFolder = os.environ.get('INSECRAWL_BACKEND', os.path.join(
+            os.path.dirname(os.path.abspath(__file__)), '..', '..', 'backend'))
+        if backendFolder not in sys.path:
+            sys.path.append(backendFolder)
+        try:
+            from models.bike_theft_detection import (BatchedFrameDetector, BikeTheftDetector,
+                                                     TiledROIDetector, load_dock_polygons)
+            from models.event_aggregator import BatchedAlertWriter, EventAggregator, jpeg_data_url, post_alerts
+            detector = BikeTheftDetector(workspace_name="bike-theft-detection",
+                                         workflow_id=self.workflow or "small-object-detection-sahi-2")
+            cameraKey = None
+            if self.docksFile:
+                # Only the tiles covering each camera's docks are sent to the model
+                detector = TiledROIDetector(detector, load_dock_polygons(self.docksFile))
+                cameraKey = 'cameraID'
+        except (ImportError, OSError, ValueError) as err:
+            self.logger.error('Could not start the detector: {}'.format(err))
+            sys.exit(self.RaiseCritical())
+        onPrediction = None
+        if self.alertsURL:
+            self.alertWriter = BatchedAlertWriter(post_alerts(self.alertsURL))
+            self.alertWriter.start()
+            # A camera is grabbed once per interval, so an incident has to
+            # outlast a few missed grabs before it is closed.
+            # The dashboard shows keyframes at the analysis tier, not full size
+            self.eventAggregator = EventAggregator(
+                self.alertWriter.submit,
+                lambda frame: jpeg_data_url(ImageCodec.encodeTiers(frame, ('analysis',))['analysis']),
+                close_after=max(30, self.interval * 3))
+            onPrediction = self.eventAggregator.on_prediction
+        self.frameDetector = BatchedFrameDetector(detector, onPrediction, camera_key=cameraKey)
+        self.frameDetector.start()
+        self.logger.info('Streaming grabbed frames to the bike theft detector')
+
     def main(self):
+        if self.detect:
+            self.StartDetector()
         if self.verboseLogging:
             self.handler.setLevel(logging.DEBUG)
-        if self.printAmount:
-            self.PrintCameraCount()
-        if self.scrapeAllCams:
-            self.ScrapeAllCameras()
-        if self.printDetails:
-            self.PrintDetails()
-        if self.oneCamera:
-            self.GetDetails()
-            self.ScrapeOne(self.cameraDetails['id'])
-        if self.customURL:
-            self.DownloadCustomURL()
-        if self.country:
-            self.logger.debug('Country code {} resolved to {}.'.format(
-                self.country, self.countryName))
-            self.ScrapePages(self.country, self.countryName)
-            
-            # If we have a set interval, sleep it and repeat the scraping loop forever
-            if self.interval != 0:
-                while True:
-                    self.logger.info(f'Waiting for {self.interval} seconds until next scrape')
-                    for i in range(self.interval):
-                        timeleft = str((self.interval - i)).zfill(len(str(self.interval)))
-                        print(f'Next run in: {timeleft}', end="\r")
-                        time.sleep(1)
-                    self.erroredScrapes.reset()
-                    self.progressCounter.reset()
-                    self.skippedImages.reset()
-                    self.successfulScrapes.reset()
-                    self.ScrapePages(self.country, self.countryName)
+        else:
+            # Debug records would only end up in the suppressed stderr, so
+            # don't build them at all.
+            self.logger.setLevel(logging.INFO)
+        try:
+            if self.printAmount:
+                self.PrintCameraCount()
+            if self.scrapeAllCams:
+                self.ScrapeAllCameras()
+            if self.printDetails:
+                self.PrintDetails()
+            if self.oneCamera:
+                self.GetDetails()
+                self.ScrapeOne(self.cameraDetails['id'])
+            if self.customURL:
+                self.DownloadCustomURL()
+            if self.country:
+                self.logger.debug('Country code {} resolved to {}.'.format(
+                    self.country, self.countryName))
+                job = self.ScrapePages(self.country, self.countryName)
+
+                # If we have a set interval, keep grabbing every camera on its own schedule forever
+                if self.interval != 0:
+                    self.stats.reset()
+                    self.RunScheduled(job)
+        except KeyboardInterrupt:
+            # CTRL+C is the only way out of --interval mode. Shut down like a
+            # finished crawl, so buffered capture records, open incidents and
+            # queued alerts are not lost.
+            self.interrupted = True
+            self.logger.info('Interrupted, finishing the grabs that are running.')
 
         self.QuitProgram()
 
@@ -3,6 +3,8 @@ import os
 import glob
 import re
 
+from CaptureLog import CaptureLog
+
 # --- Configuration ---
 # Folder containing the images, relative to this script's location or workspace root
 image_folder_relative = 'images/241657_timelapse'
@@ -10,6 +12,11 @@ image_folder_relative = 'images/241657_timelapse'
 output_video_file = 'timelapse_241657.mp4'
 # Frames per second for the output video
 fps = 5
+# Camera whose captures are looked up in the crawler's capture log
+camera_id = '241657'
+# Optional time range of the captures, as unix timestamps (None for no limit)
+start_time = None
+end_time = None
 # --- End Configuration ---
 
 # Determine the absolute path to the image folder
@@ -21,8 +28,17 @@ if not os.path.isdir(image_folder):
     print(f"Error: Image folder not found at '{image_folder}'")
     exit(1)
 
-# Get a list of all .jpg image files in the folder
-image_files = glob.glob(os.path.join(image_folder, '*.jpg'))
+# Look up the captures in the capture log insecrawl keeps in the download
+# folder. With --sortByCamera the images sit one folder below it.
+image_files = []
+for log_folder in (image_folder, os.path.dirname(image_folder)):
+    if os.path.isdir(os.path.join(log_folder, CaptureLog.dirName)):
+        capture_log = CaptureLog(log_folder, readOnly=True)
+        image_files = [path for path in capture_log.query(camera_id, start_time, end_time)
+                       if os.path.exists(path)]
+        break
+if image_files:
+    print(f"Found {len(image_files)} captures of camera {camera_id} in the capture log.")
 
 # Sort files based on the timestamp in the filename if possible
 # Example filename format: '[ID]_[YYYY-MM-DD]_[HH-MM-SS].jpg'
@@ -36,7 +52,10 @@ def sort_key(filename):
     # Fallback for files without timestamp or different format (simple name sort)
     return os.path.basename(filename)
 
-image_files.sort(key=sort_key)
+if not image_files:
+    # Folders without a capture log: list them and sort by file name
+    image_files = glob.glob(os.path.join(image_folder, '*.jpg'))
+    image_files.sort(key=sort_key)
 
 if not image_files:
     print(f"Error: No JPG images found in '{image_folder}'")